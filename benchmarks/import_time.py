@@ -0,0 +1,86 @@
+"""
+Measure how long it takes to import the comandos modules.
+
+Every module is imported in a fresh interpreter, a few times over, and the median wall time is
+reported together with the heavy optional dependencies that the import pulled in. Use the
+thresholds to keep import time in check, e.g. in CI or before a release:
+
+    python benchmarks/import_time.py --max-seconds 4
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = ["comandos.genes", "comandos.util", "comandos.dotplot_util", "comandos.plot"]
+# dependencies that must only be imported by the functions that use them
+DEFERRED = ["scanpy", "seaborn", "plotly", "samap", "requests", "tqdm"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = sorted({{name.split(".")[0] for name in sys.modules}})
+print(json.dumps({{"seconds": elapsed, "modules": loaded}}))
+"""
+
+
+def time_import(module: str, repeats: int = 5) -> dict:
+    """
+    Import a module in fresh interpreters and time it.
+
+    Parameters
+    ----------
+    module : str
+        Name of the module to import.
+    repeats : int, optional
+        Number of interpreters to start; the first one warms up the bytecode cache and is
+        discarded (default: 5).
+
+    Returns
+    -------
+    dict
+        The median import time in seconds, and the deferred dependencies that were imported.
+    """
+    times = []
+    for _ in range(repeats + 1):
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(probe["seconds"])
+    loaded = [name for name in DEFERRED if name in probe["modules"]]
+    return {"seconds": statistics.median(times[1:]), "loaded": loaded}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=None,
+        help="fail if importing any module takes longer than this",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        result = time_import(module, repeats=args.repeats)
+        slow = args.max_seconds is not None and result["seconds"] > args.max_seconds
+        failed = failed or slow or bool(result["loaded"])
+        loaded = ", ".join(result["loaded"]) or "-"
+        flag = "  SLOW" if slow else ""
+        print(f"{module:<24} {result['seconds']:6.2f} s   eager: {loaded}{flag}")
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
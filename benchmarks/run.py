@@ -0,0 +1,501 @@
+"""
+Benchmark the public entry points of comandos on synthetic data.
+
+Every case runs in a fresh interpreter on seeded synthetic data (see `synthetic.py`), which is
+generated once per scale and kept in `--data-dir`. For every case and scale the wall time and the
+peak resident memory of the call are recorded, and the results are written to a JSON file named
+after the current commit, so that runs on different commits can be compared:
+
+    python benchmarks/run.py --scales 10k 100k
+    python benchmarks/run.py compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+sys.path.insert(0, str(HERE.parent))
+
+import synthetic  # noqa: E402
+
+# ----------------------------------------------------------------------------------------------
+# cases: each one prepares its inputs from the synthetic data and returns the call to time
+
+
+def _grouped_obs_mean(data):
+    from comandos import util
+
+    return lambda: util.grouped_obs_mean(data["query"], "cluster")
+
+
+def _grouped_obs_percent(data):
+    from comandos import util
+
+    return lambda: util.grouped_obs_percent(data["query"], "cluster")
+
+
+def _grouped_obs_stats(data):
+    from comandos import util
+
+    return lambda: util.grouped_obs_stats(data["query"], "cluster")
+
+
+def _grouped_stats(data):
+    from comandos import util
+
+    return lambda: util.grouped_stats(data["query"], "cluster")
+
+
+def _batch_grouped_stats(data):
+    from comandos import util
+
+    return lambda: util.batch_grouped_stats(data["query"], ["cluster", "coarse"])
+
+
+def _find_centers(data):
+    from comandos import util
+
+    return lambda: util.find_centers(data["query"], "cluster", recompute=True)
+
+
+def _batch_collapse_unrelated_clusters(data):
+    from comandos import util
+
+    return lambda: util.batch_collapse_unrelated_clusters(
+        data["query"], "cluster", "coarse"
+    )
+
+
+def _assign_homology(data):
+    from comandos import genes
+
+    return lambda: genes.assign_homology(data["query_OGs"])
+
+
+def _calculate_orthology_score(data):
+    from comandos import genes
+
+    query = genes.assign_homology(data["query_OGs"])
+    target = genes.assign_homology(data["target_OGs"])
+    return lambda: genes.calculate_orthology_score(query, target, sparse_output=True)
+
+
+def _connections(data, n_genes=40):
+    "Homologous marker genes of the most similar cluster pair."
+    from comandos import genes
+
+    table = genes.OrthologyTable.from_homology(
+        genes.assign_homology(data["query_OGs"]),
+        genes.assign_homology(data["target_OGs"]),
+    )
+    similarity = data["similarity"]
+    row, column = np.unravel_index(np.argmax(similarity.to_numpy()), similarity.shape)
+    # strip the species prefixes
+    query_cluster = similarity.columns[column][len("qs_") :]
+    target_cluster = similarity.index[row][len("ts_") :]
+    query = data["query"]
+    in_cluster = (query.obs["cluster"] == query_cluster).to_numpy()
+    expression = np.asarray(query.X[in_cluster].mean(axis=0)).ravel()
+    markers = query.var_names[np.argsort(-expression)[:n_genes]]
+    homologs = table.homologs(query_genes=markers)
+    connections = homologs[["query", "target", "degree"]].to_numpy(dtype=object)
+    return connections[:n_genes], query_cluster, target_cluster
+
+
+def _paired_dotplot(data):
+    from comandos import plot
+
+    connections, query_cluster, target_cluster = _connections(data)
+    output = Path(tempfile.mkdtemp()) / "paired_dotplot.png"
+    return lambda: plot.paired_dotplot(
+        data["query"],
+        data["target"],
+        connections,
+        "cluster",
+        "cluster",
+        "qs",
+        "ts",
+        query_cluster=query_cluster,
+        target_cluster=target_cluster,
+        pad=False,
+        output=str(output),
+    )
+
+
+def _markers(adata, n_genes=50) -> dict:
+    "The most highly expressed genes of every cluster, as a stand-in for `rank_genes_groups`."
+    from comandos import util
+
+    means = util.grouped_obs_mean(adata, "cluster")
+    return {
+        cluster: means.index[
+            np.argsort(-means[cluster].to_numpy())[:n_genes]
+        ].to_numpy()
+        for cluster in means.columns
+    }
+
+
+def _rank_genes_groups(adata, n_genes=100) -> None:
+    "Store the top genes of every cluster in `.uns` in the layout of `sc.tl.rank_genes_groups`."
+    from comandos import util
+
+    means = util.grouped_obs_mean(adata, "cluster")
+    order = np.argsort(-means.to_numpy(), axis=0)[:n_genes]
+    names = means.index.to_numpy()[order]
+    scores = np.take_along_axis(means.to_numpy(), order, axis=0)
+    columns = [str(cluster) for cluster in means.columns]
+    adata.uns["rank_genes_groups"] = {
+        "names": np.rec.fromarrays(names.T.astype(object), names=columns),
+        "scores": np.rec.fromarrays(scores.T, names=columns),
+    }
+
+
+def _homology_inputs(data):
+    "Orthology table, query markers and ranked target genes of the genes cases."
+    from comandos import genes
+
+    table = genes.OrthologyTable.from_homology(
+        genes.assign_homology(data["query_OGs"]),
+        genes.assign_homology(data["target_OGs"]),
+    )
+    _rank_genes_groups(data["target"])
+    return table, _markers(data["query"])
+
+
+def _get_orthologs(data):
+    from comandos import genes
+
+    table, markers = _homology_inputs(data)
+    _, query_cluster, target_cluster = _connections(data)
+    return lambda: genes.get_orthologs(
+        markers[query_cluster], table, data["target"], target_cluster
+    )
+
+
+def _get_orthologs_batch(data):
+    from comandos import genes
+
+    table, markers = _homology_inputs(data)
+    # every query cluster against every target cluster
+    queries = [
+        (markers[query_cluster], str(target_cluster))
+        for query_cluster in markers
+        for target_cluster in data["target"].obs["cluster"].cat.categories
+    ]
+    return lambda: genes.get_orthologs_batch(queries, table, data["target"])
+
+
+def _get_orthologs_overlap_matrix(data):
+    from comandos import genes
+
+    table, query_markers = _homology_inputs(data)
+    target_markers = _markers(data["target"])
+    return lambda: genes.get_orthologs_overlap_matrix(
+        query_markers,
+        target_markers,
+        data["query"],
+        data["target"],
+        table,
+        return_pairs=True,
+    )
+
+
+def _batch_paired_dotplot(data, n_pairs=10):
+    from comandos import genes, plot
+
+    table, markers = _homology_inputs(data)
+    similarity = data["similarity"]
+    # the most similar pairs; their connections are looked up before the clock starts
+    threshold = np.sort(similarity.to_numpy(), axis=None)[-n_pairs - 1]
+    rows, columns = np.nonzero(similarity.to_numpy() > threshold)
+    pairs = [
+        (similarity.columns[column][len("qs_") :], similarity.index[row][len("ts_") :])
+        for row, column in zip(rows, columns)
+    ]
+    connections = genes.get_orthologs_batch(
+        [
+            (markers[query_cluster], target_cluster)
+            for query_cluster, target_cluster in pairs
+        ],
+        table,
+        data["target"],
+    )
+    output_dir = tempfile.mkdtemp()
+    return lambda: plot.batch_paired_dotplot(
+        similarity,
+        data["query"],
+        data["target"],
+        dict(zip(pairs, connections)),
+        "cluster",
+        "cluster",
+        "qs",
+        "ts",
+        threshold=threshold,
+        output_dir=output_dir,
+        pad=False,
+    )
+
+
+def _annotated_heatmap(data):
+    from comandos import plot
+
+    # annotated_heatmap only reads `sm.sams[species].adata` from the SAMAP object
+    sm = SimpleNamespace(
+        sams={
+            "qs": SimpleNamespace(adata=data["query"]),
+            "ts": SimpleNamespace(adata=data["target"]),
+        }
+    )
+    output = Path(tempfile.mkdtemp()) / "annotated_heatmap.png"
+    return lambda: plot.annotated_heatmap(
+        sm,
+        data["similarity"],
+        "qs",
+        "ts",
+        "cluster",
+        "cluster",
+        query_coarse="coarse",
+        target_coarse="coarse",
+        save=str(output),
+    )
+
+
+CASES = {
+    "grouped_obs_mean": _grouped_obs_mean,
+    "grouped_obs_percent": _grouped_obs_percent,
+    "grouped_obs_stats": _grouped_obs_stats,
+    "grouped_stats": _grouped_stats,
+    "batch_grouped_stats": _batch_grouped_stats,
+    "find_centers": _find_centers,
+    "batch_collapse_unrelated_clusters": _batch_collapse_unrelated_clusters,
+    "assign_homology": _assign_homology,
+    "calculate_orthology_score": _calculate_orthology_score,
+    "paired_dotplot": _paired_dotplot,
+    "annotated_heatmap": _annotated_heatmap,
+    "get_orthologs": _get_orthologs,
+    "get_orthologs_batch": _get_orthologs_batch,
+    "get_orthologs_overlap_matrix": _get_orthologs_overlap_matrix,
+    "batch_paired_dotplot": _batch_paired_dotplot,
+}
+
+
+# ----------------------------------------------------------------------------------------------
+# data
+
+
+def _data_path(data_dir: Path, n_cells: int, args: argparse.Namespace) -> Path:
+    name = f"{n_cells}c_{args.genes}g_{args.clusters}k_{args.density}d_{args.seed}s"
+    return data_dir / name
+
+
+def prepare_data(path: Path, n_cells: int, args: argparse.Namespace) -> None:
+    "Generate the synthetic data of one scale, unless it is already on disk."
+    if (path / "done").exists():
+        return
+    path.mkdir(parents=True, exist_ok=True)
+    data = synthetic.make_pair(
+        n_cells, args.genes, args.clusters, args.density, seed=args.seed
+    )
+    data["query"].write_h5ad(path / "query.h5ad")
+    data["target"].write_h5ad(path / "target.h5ad")
+    data["query_OGs"].to_csv(path / "query_OGs.csv", index=False)
+    data["target_OGs"].to_csv(path / "target_OGs.csv", index=False)
+    data["similarity"].to_csv(path / "similarity.csv")
+    (path / "done").touch()
+
+
+def load_data(path: Path) -> dict:
+    import anndata as ad
+
+    return {
+        "query": ad.read_h5ad(path / "query.h5ad"),
+        "target": ad.read_h5ad(path / "target.h5ad"),
+        "query_OGs": pd.read_csv(path / "query_OGs.csv"),
+        "target_OGs": pd.read_csv(path / "target_OGs.csv"),
+        "similarity": pd.read_csv(path / "similarity.csv", index_col=0),
+    }
+
+
+# ----------------------------------------------------------------------------------------------
+# measurement
+
+
+def _status_mb(field: str) -> float:
+    "Read a memory field (e.g. VmRSS, VmHWM) of this process, in MiB."
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def _reset_peak() -> bool:
+    "Reset the peak resident memory of this process (Linux only)."
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kibibytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(case: str, path: Path) -> dict:
+    "Time a single case in this process; the inputs are prepared before the clock starts."
+    data = load_data(path)
+    call = CASES[case](data)
+    resettable = _reset_peak()
+    baseline = _status_mb("VmRSS") if resettable else _max_rss_mb()
+    start = time.perf_counter()
+    call()
+    seconds = time.perf_counter() - start
+    peak = _status_mb("VmHWM") if resettable else _max_rss_mb()
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": peak,
+        "baseline_rss_mb": baseline,
+        # without a resettable peak, the peak also covers loading and preparing the data
+        "peak_is_call_only": resettable,
+    }
+
+
+def _metadata() -> dict:
+    from importlib.metadata import version
+
+    def git(*args):
+        result = subprocess.run(
+            ["git", *args], cwd=HERE.parent, capture_output=True, text=True
+        )
+        return result.stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "versions": {
+            name: version(name)
+            for name in ["numpy", "scipy", "pandas", "anndata", "matplotlib"]
+        },
+    }
+
+
+def run(args: argparse.Namespace) -> Path:
+    "Run every case at every scale, each in a fresh interpreter, and write the results."
+    records = []
+    for scale in args.scales:
+        n_cells = synthetic.parse_scale(scale)
+        path = _data_path(Path(args.data_dir), n_cells, args)
+        prepare_data(path, n_cells, args)
+        for case in args.cases:
+            runs = []
+            for _ in range(args.repeats):
+                result = subprocess.run(
+                    [sys.executable, __file__, "child", case, str(path)],
+                    capture_output=True,
+                    text=True,
+                )
+                if result.returncode != 0:
+                    print(result.stderr, file=sys.stderr)
+                    break
+                runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            if not runs:
+                print(f"{case:<36} {scale:>6}  FAILED")
+                records.append({"case": case, "scale": scale, "error": True})
+                continue
+            record = {
+                "case": case,
+                "scale": scale,
+                "cells": n_cells,
+                "genes": args.genes,
+                "clusters": args.clusters,
+                "density": args.density,
+                "seconds": statistics.median(r["seconds"] for r in runs),
+                "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+                "baseline_rss_mb": statistics.median(
+                    r["baseline_rss_mb"] for r in runs
+                ),
+                "peak_is_call_only": runs[0]["peak_is_call_only"],
+                "repeats": len(runs),
+            }
+            records.append(record)
+            print(
+                f"{case:<36} {scale:>6} {record['seconds']:9.3f} s"
+                f" {record['peak_rss_mb'] - record['baseline_rss_mb']:9.1f} MiB"
+            )
+
+    metadata = _metadata()
+    output = Path(args.output) if args.output else None
+    if output is None:
+        stamp = metadata["date"].replace(":", "").replace("-", "")[:15]
+        output = HERE / "results" / f"{stamp}_{metadata['commit'][:8]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({"metadata": metadata, "results": records}, indent=1))
+    print(f"results written to {output}")
+    return output
+
+
+def compare(old: str, new: str) -> pd.DataFrame:
+    "Line up two result files by case and scale, with the new/old ratio of time and memory."
+    tables = []
+    for path in (old, new):
+        results = json.loads(Path(path).read_text())["results"]
+        table = pd.DataFrame([r for r in results if not r.get("error")])
+        table["memory_mb"] = table["peak_rss_mb"] - table["baseline_rss_mb"]
+        tables.append(table.set_index(["case", "scale"])[["seconds", "memory_mb"]])
+    both = tables[0].join(tables[1], lsuffix="_old", rsuffix="_new", how="outer")
+    both["time_ratio"] = both["seconds_new"] / both["seconds_old"]
+    both["memory_ratio"] = both["memory_mb_new"] / both["memory_mb_old"]
+    return both
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "child":
+        print(json.dumps(run_case(sys.argv[2], Path(sys.argv[3]))))
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        with pd.option_context(
+            "display.width", 200, "display.max_rows", None, "display.max_columns", None
+        ):
+            print(compare(sys.argv[2], sys.argv[3]).round(3))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scales", nargs="+", default=["10k", "100k", "1M"])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--genes", type=int, default=2000)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--density", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--data-dir", default=str(HERE / "data"))
+    parser.add_argument(
+        "--output", default=None, help="results file (default: results/)"
+    )
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
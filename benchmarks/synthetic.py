@@ -0,0 +1,133 @@
+"""
+Seeded synthetic data at SAMap scale for the benchmarks.
+
+`make_pair` builds a query and a target `AnnData` object with a clustering and a coarse clustering,
+a UMAP-like embedding, eggNOG-style OG annotations for both gene sets and a SAMap-style cluster
+similarity matrix. The same parameters and seed always give the same data.
+"""
+
+import numpy as np
+import pandas as pd
+import anndata as ad
+from scipy import sparse
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+
+
+def parse_scale(scale: str) -> int:
+    "Translate a scale name (e.g. '100k') or a plain number into a number of cells."
+    return SCALES[scale] if scale in SCALES else int(scale)
+
+
+def make_dataset(
+    species: str,  # species ID; prepended to the gene names, like SAMap does
+    n_cells: int,  # number of cells
+    n_genes: int = 2000,  # number of genes
+    n_clusters: int = 50,  # number of clusters
+    density: float = 0.02,  # fraction of stored (nonzero) entries
+    seed: int = 0,  # random seed
+) -> (
+    ad.AnnData
+):  # cells with counts in a CSR `.X`, `cluster`/`coarse` clusterings and an `X_umap`
+    "Simulate a clustered count matrix in which every cluster over-expresses its own marker genes."
+    rng = np.random.default_rng(seed)
+    cluster_size = rng.dirichlet(np.full(n_clusters, 2.0))
+    clusters = rng.choice(n_clusters, size=n_cells, p=cluster_size)
+
+    # nonzeros per cell; a third of them fall into the markers of the cell's cluster
+    per_cell = rng.binomial(n_genes, density, size=n_cells)
+    indptr = np.concatenate([[0], np.cumsum(per_cell)])
+    owner = np.repeat(clusters, per_cell)
+    no_markers = max(n_genes // n_clusters, 1)
+    is_marker = rng.random(len(owner)) < 1 / 3
+    genes = rng.integers(0, n_genes, size=len(owner))
+    genes[is_marker] = (
+        owner[is_marker] * no_markers
+        + rng.integers(0, no_markers, size=is_marker.sum())
+    ) % n_genes
+    counts = rng.poisson(1.0, size=len(owner)) + 1 + 3 * is_marker
+    X = sparse.csr_matrix(
+        (counts.astype(np.float32), genes.astype(np.int32), indptr),
+        shape=(n_cells, n_genes),
+    )
+    X.sum_duplicates()
+
+    names = np.array([f"c{i:03d}" for i in range(n_clusters)])
+    adata = ad.AnnData(X)
+    adata.obs_names = [f"{species}_cell{i}" for i in range(n_cells)]
+    adata.var_names = [f"{species}_g{i:05d}" for i in range(n_genes)]
+    adata.obs["cluster"] = pd.Categorical(names[clusters], categories=names)
+    adata.obs["coarse"] = pd.Categorical(
+        [f"type{i // 5}" for i in clusters],
+        categories=[f"type{i}" for i in range(-(-n_clusters // 5))],
+    )
+    centers = rng.normal(scale=10, size=(n_clusters, 2))
+    adata.obsm["X_umap"] = centers[clusters] + rng.normal(size=(n_cells, 2))
+    return adata
+
+
+def make_OGs(
+    var_names: pd.Index,  # genes to annotate
+    n_families: int,  # number of gene families (Eukaryota-level OGs); shared between species
+    seed: int = 0,  # random seed
+) -> (
+    pd.DataFrame
+):  # `gene_id` and comma-separated `eggNOG_OGs`, like eggNOG-mapper output
+    "Annotate genes with eggNOG-style OGs at the root, Eukaryota and Bilateria levels."
+    rng = np.random.default_rng(seed)
+    family = rng.integers(0, n_families, size=len(var_names))
+    # every family splits into a few orthogroups at the Bilateria level
+    subfamily = family * 4 + rng.integers(0, 4, size=len(var_names))
+    OGs = [
+        f"COG{f % 97:04d}@1|root,KOG{f:05d}@2759|Eukaryota,{s:05d}@33213|Bilateria"
+        for f, s in zip(family, subfamily)
+    ]
+    annotations = pd.DataFrame({"gene_id": np.asarray(var_names), "eggNOG_OGs": OGs})
+    # like eggNOG-mapper, not every gene gets an annotation
+    return annotations[rng.random(len(annotations)) < 0.8].reset_index(drop=True)
+
+
+def make_similarity(
+    query: ad.AnnData,  # query dataset
+    target: ad.AnnData,  # target dataset
+    query_species: str,  # query species ID
+    target_species: str,  # target species ID
+    key: str = "cluster",  # `.obs` clustering of both datasets
+    seed: int = 0,  # random seed
+) -> (
+    pd.DataFrame
+):  # target clusters as rows and query clusters as columns, with species prefixes
+    "Simulate a SAMap cluster similarity matrix, with a few strongly similar pairs."
+    rng = np.random.default_rng(seed)
+    query_clusters = query.obs[key].cat.categories
+    target_clusters = target.obs[key].cat.categories
+    similarity = rng.beta(0.5, 5, size=(len(target_clusters), len(query_clusters)))
+    matches = rng.permutation(len(target_clusters))[: len(query_clusters)]
+    similarity[matches, np.arange(len(matches))] = rng.uniform(0.5, 1, len(matches))
+    return pd.DataFrame(
+        similarity,
+        index=f"{target_species}_" + target_clusters,
+        columns=f"{query_species}_" + query_clusters,
+    )
+
+
+def make_pair(
+    n_cells: int,  # number of cells of the query dataset; the target has 80% of that
+    n_genes: int = 2000,  # number of genes of every dataset
+    n_clusters: int = 50,  # number of clusters of every dataset
+    density: float = 0.02,  # fraction of stored (nonzero) entries
+    seed: int = 0,  # random seed
+) -> dict:  # `query`, `target`, `query_OGs`, `target_OGs` and `similarity`
+    "Simulate a pair of datasets for a cross-species comparison."
+    query = make_dataset("qs", n_cells, n_genes, n_clusters, density, seed)
+    target = make_dataset(
+        "ts", int(n_cells * 0.8), n_genes, n_clusters, density, seed + 1
+    )
+    n_families = max(n_genes // 4, 1)
+    return {
+        "query": query,
+        "target": target,
+        "query_OGs": make_OGs(query.var_names, n_families, seed + 2),
+        "target_OGs": make_OGs(target.var_names, n_families, seed + 3),
+        "similarity": make_similarity(query, target, "qs", "ts", seed=seed + 4),
+    }
@@ -7,8 +7,13 @@ d = { 'settings': { 'branch': 'main',
                 'lib_path': 'comandos'},
   'syms': { 'comandos.dotplot_util': { 'comandos.dotplot_util._check_colornorm': ( 'dotplot_util.html#_check_colornorm',
                                                                                    'comandos/dotplot_util.py'),
+                                       'comandos.dotplot_util._dot_frames': ('dotplot_util.html#_dot_frames', 'comandos/dotplot_util.py'),
+                                       'comandos.dotplot_util._dot_stats': ('dotplot_util.html#_dot_stats', 'comandos/dotplot_util.py'),
                                        'comandos.dotplot_util._get_mappable': ( 'dotplot_util.html#_get_mappable',
                                                                                 'comandos/dotplot_util.py'),
+                                       'comandos.dotplot_util._label_anchors': ( 'dotplot_util.html#_label_anchors',
+                                                                                 'comandos/dotplot_util.py'),
+                                       'comandos.dotplot_util._lookup': ('dotplot_util.html#_lookup', 'comandos/dotplot_util.py'),
                                        'comandos.dotplot_util.add_connections': ( 'dotplot_util.html#add_connections',
                                                                                   'comandos/dotplot_util.py'),
                                        'comandos.dotplot_util.add_homology_context': ( 'dotplot_util.html#add_homology_context',
@@ -38,24 +43,112 @@ d = { 'settings': { 'branch': 'main',
                                                                                   'comandos/dotplot_util.py'),
                                        'comandos.dotplot_util.unique_genes': ( 'dotplot_util.html#unique_genes',
                                                                                'comandos/dotplot_util.py')},
-            'comandos.genes': { 'comandos.genes.assign_homology': ('genes.html#assign_homology', 'comandos/genes.py'),
+            'comandos.genes': { 'comandos.genes.OrthologyTable': ('genes.html#orthologytable', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.__init__': ('genes.html#orthologytable.__init__', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.__len__': ('genes.html#orthologytable.__len__', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.__reduce__': ('genes.html#orthologytable.__reduce__', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.csc': ('genes.html#orthologytable.csc', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.from_dataframe': ( 'genes.html#orthologytable.from_dataframe',
+                                                                                  'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.from_homology': ( 'genes.html#orthologytable.from_homology',
+                                                                                 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.homologs': ('genes.html#orthologytable.homologs', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.load': ('genes.html#orthologytable.load', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.nnz': ('genes.html#orthologytable.nnz', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.save': ('genes.html#orthologytable.save', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.shape': ('genes.html#orthologytable.shape', 'comandos/genes.py'),
+                                'comandos.genes.OrthologyTable.to_dataframe': ( 'genes.html#orthologytable.to_dataframe',
+                                                                                'comandos/genes.py'),
+                                'comandos.genes._OG_incidence': ('genes.html#_og_incidence', 'comandos/genes.py'),
+                                'comandos.genes._gather': ('genes.html#_gather', 'comandos/genes.py'),
+                                'comandos.genes._marker_membership': ('genes.html#_marker_membership', 'comandos/genes.py'),
+                                'comandos.genes._ranked_scores': ('genes.html#_ranked_scores', 'comandos/genes.py'),
+                                'comandos.genes.assign_homology': ('genes.html#assign_homology', 'comandos/genes.py'),
                                 'comandos.genes.calculate_orthology_score': ('genes.html#calculate_orthology_score', 'comandos/genes.py'),
                                 'comandos.genes.compare_orthology': ('genes.html#compare_orthology', 'comandos/genes.py'),
+                                'comandos.genes.extract_OGs': ('genes.html#extract_ogs', 'comandos/genes.py'),
                                 'comandos.genes.filter_OGs': ('genes.html#filter_ogs', 'comandos/genes.py'),
                                 'comandos.genes.get_orthologs': ('genes.html#get_orthologs', 'comandos/genes.py'),
-                                'comandos.genes.get_orthologs_overlap': ('genes.html#get_orthologs_overlap', 'comandos/genes.py')},
-            'comandos.plot': { 'comandos.plot._plot_clustermap': ('plot.html#_plot_clustermap', 'comandos/plot.py'),
+                                'comandos.genes.get_orthologs_batch': ('genes.html#get_orthologs_batch', 'comandos/genes.py'),
+                                'comandos.genes.get_orthologs_overlap': ('genes.html#get_orthologs_overlap', 'comandos/genes.py'),
+                                'comandos.genes.get_orthologs_overlap_matrix': ( 'genes.html#get_orthologs_overlap_matrix',
+                                                                                 'comandos/genes.py')},
+            'comandos.plot': { 'comandos.plot._batch_stats': ('plot.html#_batch_stats', 'comandos/plot.py'),
+                               'comandos.plot._headless': ('plot.html#_headless', 'comandos/plot.py'),
+                               'comandos.plot._paired_dotplot_data': ('plot.html#_paired_dotplot_data', 'comandos/plot.py'),
+                               'comandos.plot._plot_clustermap': ('plot.html#_plot_clustermap', 'comandos/plot.py'),
                                'comandos.plot._plotly_clustermap': ('plot.html#_plotly_clustermap', 'comandos/plot.py'),
+                               'comandos.plot._render_dotplot': ('plot.html#_render_dotplot', 'comandos/plot.py'),
+                               'comandos.plot._strip_species': ('plot.html#_strip_species', 'comandos/plot.py'),
                                'comandos.plot.annotated_heatmap': ('plot.html#annotated_heatmap', 'comandos/plot.py'),
+                               'comandos.plot.batch_paired_dotplot': ('plot.html#batch_paired_dotplot', 'comandos/plot.py'),
                                'comandos.plot.highlighted_dimplot': ('plot.html#highlighted_dimplot', 'comandos/plot.py'),
                                'comandos.plot.highlighted_heatmap': ('plot.html#highlighted_heatmap', 'comandos/plot.py'),
                                'comandos.plot.paired_dotplot': ('plot.html#paired_dotplot', 'comandos/plot.py')},
             'comandos.report': {},
-            'comandos.util': { 'comandos.util.collapse_unrelated_clusters': ('util.html#collapse_unrelated_clusters', 'comandos/util.py'),
+            'comandos.util': { 'comandos.util.GroupedStats': ('util.html#groupedstats', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.__init__': ('util.html#groupedstats.__init__', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.__len__': ('util.html#groupedstats.__len__', 'comandos/util.py'),
+                               'comandos.util.GroupedStats._per_cell': ('util.html#groupedstats._per_cell', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.gene_codes': ('util.html#groupedstats.gene_codes', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.genes': ('util.html#groupedstats.genes', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.mean': ('util.html#groupedstats.mean', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.nbytes': ('util.html#groupedstats.nbytes', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.percent': ('util.html#groupedstats.percent', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.roll_up': ('util.html#groupedstats.roll_up', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.shape': ('util.html#groupedstats.shape', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.subset': ('util.html#groupedstats.subset', 'comandos/util.py'),
+                               'comandos.util.GroupedStats.to_frame': ('util.html#groupedstats.to_frame', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache': ('util.html#groupedstatscache', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.__init__': ('util.html#groupedstatscache.__init__', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.__len__': ('util.html#groupedstatscache.__len__', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache._lookup': ('util.html#groupedstatscache._lookup', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache._store': ('util.html#groupedstatscache._store', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.clear': ('util.html#groupedstatscache.clear', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.get': ('util.html#groupedstatscache.get', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.mean': ('util.html#groupedstatscache.mean', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.percent': ('util.html#groupedstatscache.percent', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.prefetch': ('util.html#groupedstatscache.prefetch', 'comandos/util.py'),
+                               'comandos.util.GroupedStatsCache.stats': ('util.html#groupedstatscache.stats', 'comandos/util.py'),
+                               'comandos.util.Profiler': ('util.html#profiler', 'comandos/util.py'),
+                               'comandos.util.Profiler.__enter__': ('util.html#profiler.__enter__', 'comandos/util.py'),
+                               'comandos.util.Profiler.__exit__': ('util.html#profiler.__exit__', 'comandos/util.py'),
+                               'comandos.util.Profiler.__init__': ('util.html#profiler.__init__', 'comandos/util.py'),
+                               'comandos.util.Profiler.add': ('util.html#profiler.add', 'comandos/util.py'),
+                               'comandos.util.Profiler.child': ('util.html#profiler.child', 'comandos/util.py'),
+                               'comandos.util.Profiler.stage': ('util.html#profiler.stage', 'comandos/util.py'),
+                               'comandos.util.Profiler.to_frame': ('util.html#profiler.to_frame', 'comandos/util.py'),
+                               'comandos.util._binned_modes': ('util.html#_binned_modes', 'comandos/util.py'),
+                               'comandos.util._check_transform': ('util.html#_check_transform', 'comandos/util.py'),
+                               'comandos.util._collapsed_columns': ('util.html#_collapsed_columns', 'comandos/util.py'),
+                               'comandos.util._fingerprint': ('util.html#_fingerprint', 'comandos/util.py'),
+                               'comandos.util._group_codes': ('util.html#_group_codes', 'comandos/util.py'),
+                               'comandos.util._group_indicator': ('util.html#_group_indicator', 'comandos/util.py'),
+                               'comandos.util._grouped_reduce': ('util.html#_grouped_reduce', 'comandos/util.py'),
+                               'comandos.util._hash_array': ('util.html#_hash_array', 'comandos/util.py'),
+                               'comandos.util._hash_matrix': ('util.html#_hash_matrix', 'comandos/util.py'),
+                               'comandos.util._hash_sample': ('util.html#_hash_sample', 'comandos/util.py'),
+                               'comandos.util._in_memory': ('util.html#_in_memory', 'comandos/util.py'),
+                               'comandos.util._map': ('util.html#_map', 'comandos/util.py'),
+                               'comandos.util._reduce_block': ('util.html#_reduce_block', 'comandos/util.py'),
+                               'comandos.util._row_block': ('util.html#_row_block', 'comandos/util.py'),
+                               'comandos.util._select_genes': ('util.html#_select_genes', 'comandos/util.py'),
+                               'comandos.util._take_groups': ('util.html#_take_groups', 'comandos/util.py'),
+                               'comandos.util._transformed': ('util.html#_transformed', 'comandos/util.py'),
+                               'comandos.util.batch_collapse_unrelated_clusters': ( 'util.html#batch_collapse_unrelated_clusters',
+                                                                                    'comandos/util.py'),
+                               'comandos.util.batch_grouped_stats': ('util.html#batch_grouped_stats', 'comandos/util.py'),
+                               'comandos.util.collapse_unrelated_clusters': ('util.html#collapse_unrelated_clusters', 'comandos/util.py'),
                                'comandos.util.find_center': ('util.html#find_center', 'comandos/util.py'),
+                               'comandos.util.find_centers': ('util.html#find_centers', 'comandos/util.py'),
                                'comandos.util.grouped_obs_mean': ('util.html#grouped_obs_mean', 'comandos/util.py'),
                                'comandos.util.grouped_obs_percent': ('util.html#grouped_obs_percent', 'comandos/util.py'),
                                'comandos.util.grouped_obs_present': ('util.html#grouped_obs_present', 'comandos/util.py'),
+                               'comandos.util.grouped_obs_stats': ('util.html#grouped_obs_stats', 'comandos/util.py'),
+                               'comandos.util.grouped_stats': ('util.html#grouped_stats', 'comandos/util.py'),
                                'comandos.util.map_fine_to_coarse': ('util.html#map_fine_to_coarse', 'comandos/util.py'),
                                'comandos.util.procrustes': ('util.html#procrustes', 'comandos/util.py'),
-                               'comandos.util.rescale': ('util.html#rescale', 'comandos/util.py')}}}
+                               'comandos.util.profile_stage': ('util.html#profile_stage', 'comandos/util.py'),
+                               'comandos.util.profiling': ('util.html#profiling', 'comandos/util.py'),
+                               'comandos.util.rescale': ('util.html#rescale', 'comandos/util.py'),
+                               'comandos.util.resolve_palette': ('util.html#resolve_palette', 'comandos/util.py')}}}
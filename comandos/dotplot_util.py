@@ -17,15 +17,16 @@ import numpy as np
 import pandas as pd
 from matplotlib import cm, colors
 from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection
 from matplotlib.colors import Colormap, Normalize
-from matplotlib.patches import ConnectionPatch
 from numpy.random import default_rng
+from scipy import sparse
 from scipy.sparse.csgraph import connected_components
 
 from matplotlib.colors import TwoSlopeNorm as DivNorm
 import anndata as ad
 
-from . import util
+from . import genes, util
 
 # %% ../nbs/03_dotplot_util.ipynb #642f3b6f
 def map_array_to_color(
@@ -302,13 +303,19 @@ def prepare_dotplot(
     """
     assert size_exponent > 0, "size_exponent must be > 0"
     assert dot_size > 0, "dot_size must be > 0"
-    df_avg_expr = avg_expr.reset_index().melt("index")
-    df_avg_expr.columns = ["row", "column", "value"]
+    # long format in column-major order, like `melt`; the tables of `get_dot_color` and
+    # `get_dot_size` are transposed views, so raveling them does not copy
+    no_rows, no_columns = avg_expr.shape
+    rows = np.tile(avg_expr.index.to_numpy(), no_columns)
+    columns = np.repeat(avg_expr.columns.to_numpy(), no_rows)
+    avg = avg_expr.to_numpy().ravel(order="F")
+    df_avg_expr = pd.DataFrame({"row": rows, "column": columns, "value": avg})
     color = map_to_colormap(df_avg_expr["value"], cmap=cmap, vmin=vmin, vmax=vmax)
 
-    df_perc_expr = perc_expr.reset_index().melt("index")
-    df_perc_expr.columns = ["row", "column", "value"]
-    df_perc_expr["value"] = df_perc_expr["value"] ** size_exponent * dot_size
+    perc = perc_expr.to_numpy().ravel(order="F")
+    df_perc_expr = pd.DataFrame(
+        {"row": rows, "column": columns, "value": perc**size_exponent * dot_size}
+    )
     return df_avg_expr, df_perc_expr, color
 
 
@@ -345,8 +352,11 @@ def label_pos(
 
 
 def calculate_adjacency_matrix(
-    connections: np.ndarray, query_genes: List[Any], target_genes: List[Any]
-) -> np.ndarray:
+    connections: np.ndarray,
+    query_genes: List[Any],
+    target_genes: List[Any],
+    sparse_output: bool = False,
+) -> Union[np.ndarray, sparse.csr_matrix]:
     """
     Calculate the adjacency matrix based on the given connections, query genes, and target genes.
 
@@ -359,35 +369,45 @@ def calculate_adjacency_matrix(
         A list of genes that act as queries.
     target_genes : List[Any]
         A list of genes that act as targets.
+    sparse_output : bool, optional
+        Whether to return a sparse CSR matrix instead of a dense array; `connected_components` and
+        `gene_order` accept either (default: False).
 
     Returns
     -------
-    np.ndarray
-        The adjacency matrix represented as a 2D numpy array. It has dimensions (query_G + target_G)
-        x (query_G + target_G), where query_G and target_G are the lengths of query_genes and
-        target_genes, respectively.
+    Union[np.ndarray, sparse.csr_matrix]
+        The adjacency matrix represented as a boolean matrix. It has dimensions (query_G +
+        target_G) x (query_G + target_G), where query_G and target_G are the lengths of query_genes
+        and target_genes, respectively.
     """
     query_G = len(query_genes)
     target_G = len(target_genes)
-    adjacency = np.zeros(
-        (query_G, target_G), dtype=bool
-    )  # not a true adjacency matrix; targetely the top right corner.
-    query_connected = {gene: i for i, gene in enumerate(query_genes)}
-    target_connected = {gene: i for i, gene in enumerate(target_genes)}
 
-    if connections.shape[1] == 3:
-        connections = connections[:, :2]
-    for [g1, g2] in connections:
-        if g1 is None or g2 is None:
-            continue
-        i1 = query_connected[g1]
-        i2 = target_connected[g2]
-        adjacency[i1, i2] = True
-
-    full_adjacency = np.zeros((query_G + target_G, query_G + target_G), dtype=bool)
-    full_adjacency[:query_G][:, query_G:] = adjacency
-    full_adjacency[query_G:][:, :query_G] = adjacency.T
-    return full_adjacency
+    connected = (connections[:, 0] != np.array(None)) & (
+        connections[:, 1] != np.array(None)
+    )
+    query_idx = pd.Index(query_genes).get_indexer(connections[connected, 0])
+    target_idx = pd.Index(target_genes).get_indexer(connections[connected, 1])
+    if np.any(query_idx < 0) or np.any(target_idx < 0):
+        missing = np.concatenate(
+            [
+                connections[connected, 0][query_idx < 0],
+                connections[connected, 1][target_idx < 0],
+            ]
+        )
+        raise KeyError(missing[0])
+
+    # edges in both directions; duplicated connections are summed, then binarised
+    rows = np.concatenate([query_idx, query_G + target_idx])
+    cols = np.concatenate([query_G + target_idx, query_idx])
+    full_adjacency = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, cols)),
+        shape=(query_G + target_G, query_G + target_G),
+    )
+    full_adjacency = full_adjacency.astype(bool)
+    if sparse_output:
+        return full_adjacency
+    return full_adjacency.toarray()
 
 
 def gene_order(
@@ -400,8 +420,8 @@ def gene_order(
 
     Parameters
     ----------
-    full_adjacency : np.ndarray
-        The full adjacency matrix represented as a 2D numpy array.
+    full_adjacency : Union[np.ndarray, sparse.spmatrix]
+        The full adjacency matrix, e.g. from `calculate_adjacency_matrix`.
     components : np.ndarray
         An array representing the components.
     query_G : int
@@ -413,15 +433,18 @@ def gene_order(
         A tuple containing the query gene order and the target gene order as numpy arrays.
     """
     comp, freq = np.unique(components, return_counts=True)
-    degrees = np.sum(full_adjacency, axis=0)
+    degrees = np.asarray(full_adjacency.sum(axis=0), dtype=np.int64).ravel()
 
     keep = freq > 1
     descending = np.argsort(-freq[freq > 1])
 
+    # rank the components by size; genes in larger components come first
     no_comps = len(comp[freq > 1])
-    for i, c in enumerate(comp[keep][descending]):
-        # degrees[components == c] *= freq[keep][descending][i] * (no_comps - i)
-        degrees[components == c] = no_comps - i
+    rank = np.zeros(len(comp), dtype=np.int64)
+    rank[np.flatnonzero(keep)[descending]] = no_comps - np.arange(no_comps)
+    gene_comp = np.searchsorted(comp, components)
+    in_kept = keep[gene_comp]
+    degrees[in_kept] = rank[gene_comp[in_kept]]
 
     query_degree = degrees[:query_G]
     target_degree = degrees[query_G:]
@@ -458,20 +481,62 @@ def feature_colors(
         pick_colors = rng.choice(len(godsnot_102), size=no_comps, replace=False)
     else:
         pick_colors = rng.choice(len(godsnot_102), size=no_comps, replace=True)
-    godsnot_keep = {}
-    for i, component in enumerate(comp[freq > 1]):
-        godsnot_keep[component] = godsnot_102[pick_colors][i]
-
-    components_colored = ["black"] * len(components)
-    for i, component in enumerate(components):
-        if component in comp[freq > 1]:
-            components_colored[i] = godsnot_keep[component]
+    # the color of every component; singletons stay black
+    comp_colors = np.full(len(comp), "black", dtype=object)
+    comp_colors[freq > 1] = godsnot_102[pick_colors]
+    components_colored = comp_colors[np.searchsorted(comp, components)]
 
-    query_comp_color = np.array(components_colored[:query_G])
-    target_comp_color = np.array(components_colored[query_G:])
+    query_comp_color = np.array(components_colored[:query_G].tolist())
+    target_comp_color = np.array(components_colored[query_G:].tolist())
     return query_comp_color, target_comp_color
 
 
+def _dot_stats(
+    adata: ad.AnnData,
+    clustering: str,
+    genes: Optional[np.ndarray],
+    layer: Union[str, None],
+    cache: Optional[util.GroupedStatsCache],
+    statistic: str,
+    transform: Union[str, None] = None,
+) -> util.GroupedStats:
+    "Get the grouped statistics of one side; without a cache, only `statistic` is reduced."
+    if cache is not None:
+        return cache.stats(
+            adata, clustering, layer=layer, genes=genes, transform=transform
+        )
+    return util.grouped_stats(
+        adata,
+        clustering,
+        layer=layer,
+        genes=genes,
+        sums=statistic == "sums",
+        present=statistic == "present",
+        transform=transform,
+    )
+
+
+def _dot_frames(
+    adata: ad.AnnData,
+    mean_stats: util.GroupedStats,
+    present_stats: util.GroupedStats,
+    genes: np.ndarray,
+    gene_names: Union[str, None] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Get the average expression and the fraction of expressing cells of `genes` in every cluster from
+    grouped statistics that were calculated beforehand, like `get_dot_color` and `get_dot_size` do
+    for one side; the statistics are only subset, so nothing is reduced or looked up in a cache.
+    """
+    avg_expr = mean_stats.subset(genes).to_frame("mean", transpose=True)
+    perc_expr = present_stats.subset(genes).to_frame("percent", transpose=True)
+    if gene_names is not None:
+        names = adata.var[gene_names].loc[avg_expr.columns]
+        avg_expr.columns = names
+        perc_expr.columns = names
+    return avg_expr, perc_expr
+
+
 def get_dot_size(
     query: pd.DataFrame,
     target: pd.DataFrame,
@@ -481,6 +546,7 @@ def get_dot_size(
     target_genes: Optional[np.ndarray] = None,
     query_gene_names: Optional[np.ndarray] = None,
     target_gene_names: Optional[np.ndarray] = None,
+    cache: Optional[util.GroupedStatsCache] = None,
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Calculate which percentage of cells in each cluster express each gene, and translate that to dot
@@ -497,35 +563,38 @@ def get_dot_size(
     target_clustering : str
         The .obs column name to use for the target dataset.
     query_genes : np.ndarray, optional
-        Array of query genes to subset the data, if any. If None, use all genes (default: None).
+        Array of query genes to subset the data, if any. Only these genes are reduced. If None,
+        use all genes (default: None).
     target_genes : np.ndarray, optional
-        Array of target genes to subset the data, if any. If None, use all genes (default: None).
+        Array of target genes to subset the data, if any. Only these genes are reduced. If None,
+        use all genes (default: None).
     query_gene_names : np.ndarray, optional
         Array of query gene names (default: None).
     target_gene_names : np.ndarray, optional
         Array of target gene names (default: None).
+    cache : util.GroupedStatsCache, optional
+        Cache of grouped statistics. If given, the statistics of each dataset are calculated once
+        for all genes and later calls only look up the requested genes (default: None).
 
     Returns
     -------
     Tuple[pd.DataFrame, pd.DataFrame]
         A tuple containing the dot size values for query and target datasets, respectively.
     """
+    # only reduce the genes we have, instead of subsetting afterwards
+    subset = query_genes is not None and target_genes is not None
+    if not subset:
+        query_genes, target_genes = None, None
 
-    query_cluster_size = query.obs[query_clustering].value_counts()
-    target_cluster_size = target.obs[target_clustering].value_counts()
-
-    query_perc_expr = (
-        util.grouped_obs_present(query, query_clustering) / query_cluster_size
+    query_stats = _dot_stats(
+        query, query_clustering, query_genes, None, cache, "present"
     )
-    target_perc_expr = (
-        util.grouped_obs_present(target, target_clustering) / target_cluster_size
+    target_stats = _dot_stats(
+        target, target_clustering, target_genes, None, cache, "present"
     )
-
-    # subset to only the genes we have
-    if query_genes is not None and target_genes is not None:
-        query_perc_expr = query_perc_expr.loc[query_genes].copy().T
-        target_perc_expr = target_perc_expr.loc[target_genes].copy().T
-    else:
+    query_perc_expr = query_stats.to_frame("percent", transpose=subset)
+    target_perc_expr = target_stats.to_frame("percent", transpose=subset)
+    if not subset:
         print("No genes supplied; returning all genes.")
 
     if query_gene_names is not None:
@@ -549,12 +618,14 @@ def get_dot_color(
     query_gene_names: Optional[np.ndarray] = None,
     target_gene_names: Optional[np.ndarray] = None,
     layer: Union[str, None] = None,
+    cache: Optional[util.GroupedStatsCache] = None,
+    transform: Union[str, None] = None,
 ) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Calculate average expression in each cluster and translate that to dot color for the dotplot.
     Note that this function does not know what you did with the matrix before; if you have
     log-transformed the data it will calculate an average of logs, not the log of the
-    exp-transformed average.
+    exp-transformed average, unless you set `transform="expm1"`.
 
     Parameters
     ----------
@@ -567,9 +638,11 @@ def get_dot_color(
     target_clustering : str
         The .obs column name to use for the target dataset.
     query_genes : np.ndarray, optional
-        Array of query genes to subset the data, if any. If None, use all genes (default: None).
+        Array of query genes to subset the data, if any. Only these genes are reduced. If None,
+        use all genes (default: None).
     target_genes : np.ndarray, optional
-        Array of target genes to subset the data, if any. If None, use all genes (default: None).
+        Array of target genes to subset the data, if any. Only these genes are reduced. If None,
+        use all genes (default: None).
     query_gene_names : np.ndarray, optional
         Array of query gene names (default: None).
     target_gene_names : np.ndarray, optional
@@ -578,19 +651,32 @@ def get_dot_color(
         The layer to use for the average expression calculation. If not specified, it will use the
         `.X` slot of the `AnnData` objects. It is vital to set this correctly to avoid calculating
         average expression on log1p-transformed data (default: None).
+    cache : util.GroupedStatsCache, optional
+        Cache of grouped statistics. If given, the statistics of each dataset are calculated once
+        for all genes and later calls only look up the requested genes (default: None).
+    transform : Union[str, None], optional
+        Transform of the values before averaging. "expm1" averages log1p-normalised data in linear
+        space without creating a counts layer or a dense copy of the matrix (default: None).
 
     Returns
     -------
     Tuple[pd.DataFrame, pd.DataFrame]
         A tuple containing the dot color values for query and target datasets, respectively.
     """
-    query_avg_expr = util.grouped_obs_mean(query, query_clustering, layer=layer)
-    target_avg_expr = util.grouped_obs_mean(target, target_clustering, layer=layer)
-    # subset to only the genes we have
-    if query_genes is not None and target_genes is not None:
-        query_avg_expr = query_avg_expr.loc[query_genes].copy().T
-        target_avg_expr = target_avg_expr.loc[target_genes].copy().T
-    else:
+    # only reduce the genes we have, instead of subsetting afterwards
+    subset = query_genes is not None and target_genes is not None
+    if not subset:
+        query_genes, target_genes = None, None
+
+    query_stats = _dot_stats(
+        query, query_clustering, query_genes, layer, cache, "sums", transform
+    )
+    target_stats = _dot_stats(
+        target, target_clustering, target_genes, layer, cache, "sums", transform
+    )
+    query_avg_expr = query_stats.to_frame("mean", transpose=subset)
+    target_avg_expr = target_stats.to_frame("mean", transpose=subset)
+    if not subset:
         print("No genes supplied; returning all genes.")
 
     if query_gene_names is not None:
@@ -754,6 +840,46 @@ def make_dotplot(
     [t.set_color(gene_color[i]) for i, t in enumerate(ax.yaxis.get_ticklabels())]
 
 
+def _label_anchors(fig: plt.Figure, ax: plt.Axes, side: str = "left") -> pd.DataFrame:
+    """
+    Get the edge coordinates of all y-axis tick labels of an Axes at once, as `label_pos` does for
+    one label.
+
+    Parameters
+    ----------
+    fig : plt.Figure
+        The figure the Axes belongs to.
+    ax : plt.Axes
+        The Axes whose y tick labels to locate.
+    side : str, optional
+        One of "left" or "right"; depending on orientation will return the leftmost or rightmost
+        position of the labels (default: "left").
+
+    Returns
+    -------
+    pd.DataFrame
+        The x and y coordinates (in figure fraction) of every label, indexed by the label text.
+    """
+    renderer = fig.canvas.get_renderer()
+    labels = ax.get_yticklabels()
+    extents = np.array([label.get_window_extent(renderer).extents for label in labels])
+    extents = (
+        fig.transFigure.inverted().transform(extents.reshape(-1, 2)).reshape(-1, 4)
+    )
+    x = extents[:, 2] if side == "left" else extents[:, 0]
+    y = (extents[:, 1] + extents[:, 3]) / 2
+    return pd.DataFrame({"x": x, "y": y}, index=[label.get_text() for label in labels])
+
+
+def _lookup(index: pd.Index, keys: np.ndarray) -> np.ndarray:
+    "Find the positions of `keys` in `index`, using the last position of duplicated entries."
+    last = np.flatnonzero(~index.duplicated(keep="last"))
+    positions = index[last].get_indexer(keys)
+    if np.any(positions < 0):
+        raise KeyError(keys[positions < 0][0])
+    return last[positions]
+
+
 def add_connections(
     fig: plt.Figure,
     connections: np.ndarray,
@@ -783,48 +909,51 @@ def add_connections(
     None
     """
 
-    label_offset = np.array([label_offset, 0])
     left = fig.get_axes()[0]
     right = fig.get_axes()[1]
+    connections = np.asarray(connections, dtype=object)
+    if len(connections) == 0:
+        return
+
+    # anchor every link to the right end of the query label and the left end of the target label
+    left_anchors = _label_anchors(fig, left, side="left") + [label_offset, 0]
+    right_anchors = _label_anchors(fig, right, side="right") - [label_offset, 0]
+
+    gene_from, gene_to = connections[:, 0], connections[:, 1]
+    connected = (gene_from != np.array(None)) & (gene_to != np.array(None))
+    gene_from, gene_to = gene_from[connected], gene_to[connected]
+    segments = np.stack(
+        [
+            left_anchors.iloc[_lookup(left_anchors.index, gene_from)].to_numpy(),
+            right_anchors.iloc[_lookup(right_anchors.index, gene_to)].to_numpy(),
+        ],
+        axis=1,
+    )
+    line_colors = np.asarray(query_gene_colors)[
+        _lookup(pd.Index(query_gene_names), gene_from)
+    ]
 
-    left_labels = {}
-    for label in left.get_yticklabels():
-        bbox = label.get_window_extent()
-        coords = fig.transFigure.inverted().transform(bbox)
-        left_labels[label.get_text()] = coords + label_offset
-
-    right_labels = {}
-    for label in right.get_yticklabels():
-        bbox = label.get_window_extent()
-        coords = fig.transFigure.inverted().transform(bbox)
-        right_labels[label.get_text()] = coords - label_offset
-
-    query_index = {g: i for i, g in enumerate(query_gene_names)}
-    for c in connections:
-        linestyle = "dotted"
-        if len(c) == 3:
-            gene_from, gene_to, ls = c
-            if ls == 0:
-                linestyle = (0, (1, 5))
-            elif ls == 1:
-                linestyle = (0, (5, 5))
-            elif ls == 2:
-                linestyle = "solid"
-        else:
-            gene_from, gene_to = c
-        if gene_from is None or gene_to is None:
-            continue
-        species_a = label_pos(left_labels, gene_from, side="left")
-        species_b = label_pos(right_labels, gene_to, side="right")
-        con = ConnectionPatch(
-            xyA=species_a,
-            xyB=species_b,
-            coordsA="figure fraction",
-            coordsB="figure fraction",
-            color=query_gene_colors[query_index[gene_from]],
-            linestyle=linestyle,
+    # one collection per line style: unknown strength, paralogs and orthologs
+    linestyles = ["dotted", (0, (1, 5)), (0, (5, 5)), "solid"]
+    style = np.zeros(len(segments), dtype=int)
+    if connections.shape[1] == 3:
+        strength = connections[connected, 2]
+        for value in [0, 1, 2]:
+            style[strength == value] = value + 1
+    for code in np.unique(style):
+        is_style = style == code
+        lines = LineCollection(
+            segments[is_style],
+            colors=line_colors[is_style],
+            linestyles=[linestyles[code]],
+            linewidths=mpl.rcParams["patch.linewidth"],
+            capstyle="butt",
+            joinstyle="round",
+            transform=fig.transFigure,
+            clip_on=False,
+            zorder=1,
         )
-        right.add_artist(con)
+        right.add_collection(lines, autolim=False)
 
 
 def plot_dotplot(
@@ -911,97 +1040,107 @@ def plot_dotplot(
     query_N, query_G = query_avg_expr.shape
     target_N, target_G = target_avg_expr.shape
 
-    # sometimes we end up overcorrecting when batch-producing images this way
-    y_size = np.max([query_G, target_G]) / 2 + y_offset
-    if y_size < 0:
-        y_size = np.max([query_G, target_G]) / 2
-
-    # create empty figure that scales with number of clusters and genes
-    figsize = ((query_N + target_N) / 2 + x_offset, y_size)
-
-    fig = plt.figure(figsize=figsize)
-    max_genes = np.max([query_G, target_G])
-    columns = query_N + target_N + grid_offset + 6
-    ax = fig.add_gridspec(max_genes, columns)
-
-    # add space for the left dotplot (query)
-    left_start = 0
-    if center and query_G > max_genes:
-        left_start = (max_genes - query_G) // 2 - 1
-    left_end = left_start + query_G
-    left = fig.add_subplot(ax[left_start:left_end, 0:query_N])
-
-    # add space for the right dotplot (target)
-    right_start = 0
-    if center and target_G > max_genes:
-        right_start = (max_genes - target_G) // 2 - 1
-    right_end = right_start + target_G
-
-    after_blank = query_N + grid_offset
-    before_legends = query_N + grid_offset + target_N
-    right = fig.add_subplot(
-        ax[
-            right_start:right_end,
-            after_blank:before_legends,
-        ]
-    )
+    sizes = {
+        "clusters": query_N + target_N,
+        "genes": query_G + target_G,
+        "connections": len(connections),
+    }
+    with util.profile_stage("layout", **sizes):
+        # sometimes we end up overcorrecting when batch-producing images this way
+        y_size = np.max([query_G, target_G]) / 2 + y_offset
+        if y_size < 0:
+            y_size = np.max([query_G, target_G]) / 2
+
+        # create empty figure that scales with number of clusters and genes
+        figsize = ((query_N + target_N) / 2 + x_offset, y_size)
+
+        fig = plt.figure(figsize=figsize)
+        max_genes = np.max([query_G, target_G])
+        columns = query_N + target_N + grid_offset + 6
+        ax = fig.add_gridspec(max_genes, columns)
+
+        # add space for the left dotplot (query)
+        left_start = 0
+        if center and query_G > max_genes:
+            left_start = (max_genes - query_G) // 2 - 1
+        left_end = left_start + query_G
+        left = fig.add_subplot(ax[left_start:left_end, 0:query_N])
+
+        # add space for the right dotplot (target)
+        right_start = 0
+        if center and target_G > max_genes:
+            right_start = (max_genes - target_G) // 2 - 1
+        right_end = right_start + target_G
+
+        after_blank = query_N + grid_offset
+        before_legends = query_N + grid_offset + target_N
+        right = fig.add_subplot(
+            ax[
+                right_start:right_end,
+                after_blank:before_legends,
+            ]
+        )
 
-    left.set_zorder(0)
-    right.set_zorder(1)
-
-    make_dotplot(
-        left,
-        query_avg_expr,
-        query_perc_expr,
-        query_genes,
-        query_species,
-        query_clustering,
-        query_cluster_colors,
-        query_gene_colors,
-        side="left",
-        cmap=cmap,
-    )
+        left.set_zorder(0)
+        right.set_zorder(1)
+
+        make_dotplot(
+            left,
+            query_avg_expr,
+            query_perc_expr,
+            query_genes,
+            query_species,
+            query_clustering,
+            query_cluster_colors,
+            query_gene_colors,
+            side="left",
+            cmap=cmap,
+        )
 
-    make_dotplot(
-        right,
-        target_avg_expr,
-        target_perc_expr,
-        target_genes,
-        target_species,
-        target_clustering,
-        target_cluster_colors,
-        target_gene_colors,
-        side="right",
-        cmap=cmap,
-    )
+        make_dotplot(
+            right,
+            target_avg_expr,
+            target_perc_expr,
+            target_genes,
+            target_species,
+            target_clustering,
+            target_cluster_colors,
+            target_gene_colors,
+            side="right",
+            cmap=cmap,
+        )
 
-    # saving the figure: don't forget the dpi option!
-    if title is not None:
-        fig.suptitle(title, fontsize=title_font_size)
-    fig.savefig(output)
+        if title is not None:
+            fig.suptitle(title, fontsize=title_font_size)
+        # lay out the tick labels without rasterizing the figure; the connections need their extents
+        fig.draw_without_rendering()
 
-    # calculate label offset to make the links between genes more legible
-    label_offset = 1 / (query_N + target_N + grid_offset * 2) / 3
-    # draw appropriately colored lines between connected genes
-    add_connections(fig, connections, query_genes, query_gene_colors, label_offset)
+    with util.profile_stage("connections", **sizes):
+        # calculate label offset to make the links between genes more legible
+        label_offset = 1 / (query_N + target_N + grid_offset * 2) / 3
+        # draw appropriately colored lines between connected genes
+        add_connections(fig, connections, query_genes, query_gene_colors, label_offset)
 
-    dot_start = right_start + target_G // 3
-    cbar_start = right_start + 2 * (target_G // 3)
+    with util.profile_stage("legends", **sizes):
+        dot_start = right_start + target_G // 3
+        cbar_start = right_start + 2 * (target_G // 3)
 
-    if cbar_start - dot_start < 3:
-        cbar_start = dot_start + 3
+        if cbar_start - dot_start < 3:
+            cbar_start = dot_start + 3
 
-    dot_legend = fig.add_subplot(ax[dot_start : (dot_start + 1), -5:])
-    plot_dot_legend(dot_legend)
+        dot_legend = fig.add_subplot(ax[dot_start : (dot_start + 1), -5:])
+        plot_dot_legend(dot_legend)
 
-    cbar_legend = fig.add_subplot(ax[cbar_start : (cbar_start + 1), -5:])
-    plot_colorbar_legend(cbar_legend, query_avg_expr, target_avg_expr, cmap=cmap)
+        cbar_legend = fig.add_subplot(ax[cbar_start : (cbar_start + 1), -5:])
+        plot_colorbar_legend(cbar_legend, query_avg_expr, target_avg_expr, cmap=cmap)
 
-    plt.savefig(output)
+    with util.profile_stage("savefig", **sizes):
+        # saving the figure: don't forget the dpi option!
+        fig.savefig(output)
 
 
 def add_homology_context(
-    connections: np.ndarray, orthology: pd.DataFrame
+    connections: np.ndarray, orthology: Union[pd.DataFrame, genes.OrthologyTable]
 ) -> np.ndarray:
     """
     Add homology context to the given connections based on the orthology information.
@@ -1010,8 +1149,8 @@ def add_homology_context(
     ----------
     connections : np.ndarray
         The connections between genes. The columns should be (query_gene, target_gene).
-    orthology : pd.DataFrame
-        The orthology information as a DataFrame.
+    orthology : Union[pd.DataFrame, genes.OrthologyTable]
+        The orthology information as a DataFrame or an `OrthologyTable`.
 
     Returns
     -------
@@ -1026,13 +1165,13 @@ def add_homology_context(
     query_orthology = np.intersect1d(query_genes, orthology.index)
     target_orthology = np.intersect1d(target_genes, orthology.columns)
 
-    subset = (
-        orthology.loc[query_orthology][target_orthology]
-        .melt(ignore_index=False)
-        .reset_index(drop=False)
-    )
+    if not isinstance(orthology, genes.OrthologyTable):
+        orthology = genes.OrthologyTable.from_dataframe(
+            orthology.loc[query_orthology, target_orthology]
+        )
+    subset = orthology.homologs(query_orthology, target_orthology, by="target")
 
-    homologs = subset[subset["value"] > 0]
+    homologs = subset[subset["degree"] > 0]
     homologs.columns = ["query_id", "target_id", "value"]
     query_no_homology = np.setdiff1d(query_genes, homologs["query_id"])
     target_no_homology = np.setdiff1d(target_genes, homologs["target_id"])
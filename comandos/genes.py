@@ -3,17 +3,25 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/01_genes.ipynb.
 
 # %% auto #0
-__all__ = ['filter_OGs', 'assign_homology', 'calculate_orthology_score', 'get_orthologs', 'get_orthologs_overlap']
+__all__ = ['filter_OGs', 'extract_OGs', 'assign_homology', 'calculate_orthology_score', 'OrthologyTable', 'get_orthologs_batch',
+           'get_orthologs', 'get_orthologs_overlap', 'get_orthologs_overlap_matrix']
 
 # %% ../nbs/01_genes.ipynb #29243583
 import os
-from typing import Union
+import re
+from collections import OrderedDict
+from typing import List, Tuple, Union
 
 import anndata as ad
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 # %% ../nbs/01_genes.ipynb #04144078
+# an EggNOG OG is written as `OG_ID@taxonomic_ID`, optionally followed by `|taxonomic_name`
+_OG_PATTERN = r"^[^@]*@(?P<tax_id>[^|]*)(?:\|(?P<tax_name>.*))?$"
+
+
 def filter_OGs(
     x: Union[
         list, str
@@ -21,67 +29,501 @@ def filter_OGs(
     paralog: str = "Eukaryota",  # the level of the paralog OG
     ortholog: str = "Bilateria",  # the level of the ortholog OG
 ) -> list:  # the paralog OG and ortholog OG
-    "Find the EggNOG OGs at the the paralog and ortholog level."
+    """
+    Find the EggNOG OGs at the paralog and ortholog level. A level matches an OG if it is equal to
+    its taxonomic ID or name, e.g. "2759" or "Eukaryota"; parts of them, such as "Eukaryot" or
+    "275", no longer match as they did when the whole OG string was searched.
+    """
     paralog_OG = ""
     ortholog_OG = ""
     if isinstance(x, str):
         x = x.split(",")
     for s in x:
-        if paralog in s:
+        match = re.match(_OG_PATTERN, s)
+        if match is None:
+            continue
+        if paralog in match.groups():
             paralog_OG = s
-        if ortholog in s:
+        if ortholog in match.groups():
             ortholog_OG = s
     return [paralog_OG, ortholog_OG]
 
 # %% ../nbs/01_genes.ipynb #a2aa2243
+def extract_OGs(
+    species_OGs: pd.DataFrame,  # the dataframe with the gene_id and the EggNOG OGs
+    levels: dict,  # the taxonomic level (ID or name) to extract for every output column; it must match the ID or name exactly, see `filter_OGs`
+) -> pd.DataFrame:  # the dataframe with the gene_id and the OG at every level
+    "Find the EggNOG OGs of every gene at several taxonomic levels in one pass."
+    gene_ids = species_OGs["gene_id"].reset_index(drop=True)
+    OGs = species_OGs["eggNOG_OGs"].reset_index(drop=True).str.split(",").explode()
+    OGs = OGs[OGs.notna()]
+    # OGs are shared by many genes, so parse every distinct OG only once. Sorting the codes means
+    # that the smallest code is also the alphabetically first OG.
+    codes, unique_OGs = pd.factorize(OGs, sort=True)
+    taxonomy = pd.Series(unique_OGs).str.extract(_OG_PATTERN)
+    names = np.append(np.asarray(unique_OGs, dtype=object), None)
+
+    result = {}
+    for column, level in levels.items():
+        at_level = (taxonomy["tax_id"] == level) | (taxonomy["tax_name"] == level)
+        row_codes = pd.Series(codes, index=OGs.index)[at_level.to_numpy()[codes]]
+        # like `filter_OGs`, the last OG at the level wins
+        row_codes = row_codes[~row_codes.index.duplicated(keep="last")]
+        row_codes = row_codes.reindex(gene_ids.index, fill_value=-1)
+        # a gene without an OG in any of its entries gets no OG (code -1)
+        first = row_codes.groupby(gene_ids, observed=False).min()
+        result[column] = pd.Series(
+            names[first.fillna(-1).astype(int)], index=first.index
+        )
+
+    return pd.DataFrame(result)
+
+
 def assign_homology(
     species_OGs,  # the dataframe with the gene_id and the EggNOG OGs
     paralog: str = "Eukaryota",  # the level of the paralog OG
     ortholog: str = "Bilateria",  # the level of the ortholog OG)
 ) -> pd.DataFrame:  # the dataframe with the gene_id, paralog OG and ortholog OG
     "Get the taxonomy of the genes."
-    homologs = (
-        species_OGs["eggNOG_OGs"]
-        .apply(filter_OGs, paralog=paralog, ortholog=ortholog)
-        .to_list()
-    )
-    taxonomy = pd.DataFrame(homologs, columns=["paralog", "ortholog"])
-    species_OGs = species_OGs.join(taxonomy)
+    return extract_OGs(species_OGs, {"ortholog": ortholog, "paralog": paralog})
 
-    orthologs = pd.DataFrame(
-        species_OGs.groupby("gene_id", observed=False)["ortholog"].apply(np.unique).str[0]
-    )
-    paralogs = pd.DataFrame(
-        species_OGs.groupby("gene_id", observed=False)["paralog"].apply(np.unique).str[0]
+# %% ../nbs/01_genes.ipynb #a23f919f
+def _OG_incidence(
+    codes: np.ndarray,  # OG code of every gene (-1 if the gene has no OG)
+    no_OGs: int,  # number of OGs
+) -> sparse.csr_matrix:  # a sparse genes$\times$OGs membership matrix
+    "Encode OG membership as a sparse incidence matrix."
+    genes = np.flatnonzero(codes >= 0)
+    return sparse.csr_matrix(
+        (np.ones(len(genes), dtype=np.int64), (genes, codes[genes])),
+        shape=(len(codes), no_OGs),
     )
 
-    result = orthologs.join(paralogs)
-    result.replace(to_replace="", value=None, inplace=True)
-    return result
 
-# %% ../nbs/01_genes.ipynb #a23f919f
-def compare_orthology(query, target):
-    result = []
-    for x in query:
-        result.append(target == x)
+def _gather(
+    matrix: sparse.spmatrix,  # a CSR (or CSC) matrix
+    lines: np.ndarray,  # the rows (or columns) to gather
+) -> Tuple[
+    np.ndarray, np.ndarray
+]:  # the position in `lines` and the position in `matrix.indices`/`matrix.data` of every entry
+    "Find the stored entries of some rows of a CSR matrix (or columns of a CSC matrix)."
+    starts = matrix.indptr[lines]
+    lengths = matrix.indptr[np.asarray(lines) + 1] - starts
+    entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.repeat(np.arange(len(lengths)), lengths), entries + np.arange(
+        len(entries)
+    )
 
-    result = pd.DataFrame(result)
-    result.index = query.index
-    return result
+
+def compare_orthology(
+    query: pd.Series,  # the OG of every query gene
+    target: pd.Series,  # the OG of every target gene
+) -> (
+    sparse.csr_matrix
+):  # a sparse query$\times$target matrix, 1 where the genes share an OG
+    "Find the query and target genes that belong to the same OG."
+    codes, OGs = pd.factorize(pd.concat([query, target], ignore_index=True))
+    query_OGs = _OG_incidence(codes[: len(query)], len(OGs))
+    target_OGs = _OG_incidence(codes[len(query) :], len(OGs))
+    return (query_OGs @ target_OGs.T).tocsr()
 
 # %% ../nbs/01_genes.ipynb #9789f9f2
 def calculate_orthology_score(
     query: pd.DataFrame,  # the dataframe with the gene_id, paralog OG and ortholog OG for the query species
     target: pd.DataFrame,
+    sparse_output: bool = False,  # if True, return a sparse dataframe that only stores related gene pairs
 ) -> pd.DataFrame:
     orthologs = compare_orthology(query["ortholog"], target["ortholog"])
     paralogs = compare_orthology(query["paralog"], target["paralog"])
-    orthology_score = orthologs.astype(int) + paralogs.astype(int)
-    return orthology_score
+    orthology_score = orthologs + paralogs
+    if sparse_output:
+        return pd.DataFrame.sparse.from_spmatrix(
+            orthology_score, index=query.index, columns=target.index
+        )
+    return pd.DataFrame(
+        orthology_score.toarray(), index=query.index, columns=target.index
+    )
+
+# %% ../nbs/01_genes.ipynb #2aada705
+class OrthologyTable:
+    """
+    A sparse query$\\times$target orthology table. Only related gene pairs are stored, in CSR/CSC
+    arrays, and genes are looked up through hashed indices, so that finding the homologs of a set
+    of genes takes time proportional to the number of homologs.
+
+    Parameters
+    ----------
+    scores : scipy.sparse.spmatrix
+        The orthology scores; 2 for orthologs, 1 for paralogs and 0 (not stored) otherwise.
+    query_genes : Iterable[str]
+        The query genes, one per row of `scores`.
+    target_genes : Iterable[str]
+        The target genes, one per column of `scores`.
+    """
+
+    def __init__(self, scores, query_genes, target_genes):
+        self.index = pd.Index(query_genes)
+        self.columns = pd.Index(target_genes)
+        if scores.shape != (len(self.index), len(self.columns)):
+            raise ValueError(
+                f"scores of shape {scores.shape} do not match {len(self.index)} query and "
+                f"{len(self.columns)} target genes"
+            )
+        # copy, so that cleaning up the matrix does not change the caller's
+        self.csr = sparse.csr_matrix(scores, copy=True)
+        self.csr.eliminate_zeros()
+        self.csr.sort_indices()
+        self._csc = None
+        self._path = None
+
+    @classmethod
+    def from_dataframe(cls, orthology: pd.DataFrame) -> "OrthologyTable":
+        "Convert a (dense or sparse) orthology dataframe, e.g. from `calculate_orthology_score`."
+        # every column of a frame without columns counts as sparse, but `to_coo` needs dtypes
+        all_sparse = orthology.shape[1] > 0 and all(
+            isinstance(dtype, pd.SparseDtype) for dtype in orthology.dtypes
+        )
+        if all_sparse and orthology.size > 0:
+            scores = orthology.sparse.to_coo()
+        else:
+            values = orthology.to_numpy()
+            if values.dtype == object:
+                # let numpy infer a numeric dtype; scipy does not store objects
+                values = np.array(values.tolist(), dtype=None).reshape(values.shape)
+            scores = sparse.csr_matrix(values)
+        return cls(scores, orthology.index, orthology.columns)
+
+    @classmethod
+    def from_homology(
+        cls, query: pd.DataFrame, target: pd.DataFrame
+    ) -> "OrthologyTable":
+        "Score the genes of two species, as `calculate_orthology_score` does, without a dense table."
+        orthologs = compare_orthology(query["ortholog"], target["ortholog"])
+        paralogs = compare_orthology(query["paralog"], target["paralog"])
+        return cls(orthologs + paralogs, query.index, target.index)
+
+    def save(self, path: str) -> None:
+        """
+        Save the table to a directory of `.npy` files that `OrthologyTable.load` can memory-map.
+
+        Parameters
+        ----------
+        path : str
+            The directory to save the table to. It will be created if it does not exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "query_genes": np.asarray(self.index, dtype=str),
+            "target_genes": np.asarray(self.columns, dtype=str),
+        }
+        for name, matrix in [("csr", self.csr), ("csc", self.csc)]:
+            arrays[f"{name}_data"] = matrix.data
+            arrays[f"{name}_indices"] = matrix.indices
+            arrays[f"{name}_indptr"] = matrix.indptr
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + ".npy"), array, allow_pickle=False)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "OrthologyTable":
+        """
+        Load a table saved with `OrthologyTable.save`.
+
+        Parameters
+        ----------
+        path : str
+            The directory the table was saved to.
+        mmap : bool, optional
+            If True, memory-map the scores instead of reading them. Opening the table is then
+            nearly instantaneous, and processes that load the same table share its memory
+            (default: True).
+
+        Returns
+        -------
+        OrthologyTable
+            The loaded table.
+        """
+
+        def read(name):
+            return np.load(
+                os.path.join(path, name + ".npy"),
+                mmap_mode="r" if mmap else None,
+                allow_pickle=False,
+            )
+
+        table = cls.__new__(cls)
+        table.index = pd.Index(read("query_genes"), dtype=object)
+        table.columns = pd.Index(read("target_genes"), dtype=object)
+        shape = (len(table.index), len(table.columns))
+        # the saved arrays are already canonical, so wrap them without copying
+        table.csr = sparse.csr_matrix(
+            (read("csr_data"), read("csr_indices"), read("csr_indptr")), shape=shape
+        )
+        table._csc = sparse.csc_matrix(
+            (read("csc_data"), read("csc_indices"), read("csc_indptr")), shape=shape
+        )
+        table._path = os.path.abspath(path) if mmap else None
+        return table
+
+    def __reduce__(self):
+        # memory-mapped tables are sent to other processes by path, so that they share pages
+        if self._path is not None:
+            return (OrthologyTable.load, (self._path,))
+        return (OrthologyTable, (self.csr, self.index, self.columns))
+
+    @property
+    def csc(self) -> sparse.csc_matrix:
+        "The scores in CSC format, for lookups by target gene."
+        if self._csc is None:
+            self._csc = self.csr.tocsc()
+            self._csc.sort_indices()
+        return self._csc
+
+    @property
+    def shape(self) -> tuple:
+        return self.csr.shape
+
+    @property
+    def nnz(self) -> int:
+        "The number of related gene pairs."
+        return self.csr.nnz
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def to_dataframe(self, sparse_output: bool = False) -> pd.DataFrame:
+        "Convert to a (dense or sparse) orthology dataframe."
+        if sparse_output:
+            return pd.DataFrame.sparse.from_spmatrix(
+                self.csr, index=self.index, columns=self.columns
+            )
+        return pd.DataFrame(self.csr.toarray(), index=self.index, columns=self.columns)
+
+    def homologs(
+        self, query_genes=None, target_genes=None, by: str = "query"
+    ) -> pd.DataFrame:
+        """
+        Find the homologs of the given genes, with their degree. Genes that are not in the table
+        are ignored.
+
+        Parameters
+        ----------
+        query_genes : Iterable[str], optional
+            Query genes to find the homologs of. If None, use all query genes (default: None).
+        target_genes : Iterable[str], optional
+            Target genes to restrict the homologs to. If None, use all target genes (default:
+            None).
+        by : str, optional
+            If "query", sort the pairs by query gene first, if "target" by target gene first.
+            Genes are sorted in the order they are given in (default: "query").
+
+        Returns
+        -------
+        pd.DataFrame
+            The homologous pairs, with columns 'query', 'target', and 'degree', where degree is 1
+            for paralogs and 2 for orthologs.
+        """
+        query_genes = (
+            self.index if query_genes is None else pd.unique(np.asarray(query_genes))
+        )
+        target_genes = (
+            self.columns
+            if target_genes is None
+            else pd.unique(np.asarray(target_genes))
+        )
+        # gather the stored entries of the rows of the query genes, or the columns of the target
+        # genes if there are fewer of them
+        if len(query_genes) <= len(target_genes):
+            matrix, own, own_index, other, other_index = (
+                self.csr,
+                query_genes,
+                self.index,
+                target_genes,
+                self.columns,
+            )
+        else:
+            matrix, own, own_index, other, other_index = (
+                self.csc,
+                target_genes,
+                self.columns,
+                query_genes,
+                self.index,
+            )
+        lines = own_index.get_indexer(own)
+        lookups = np.flatnonzero(lines >= 0)
+        owner, entries = _gather(matrix, lines[lookups])
+        own_pos = lookups[owner]
+        other_pos = pd.Index(other).get_indexer(other_index[matrix.indices[entries]])
+        keep = other_pos >= 0
+        own_pos, other_pos, degree = (
+            own_pos[keep],
+            other_pos[keep],
+            matrix.data[entries][keep],
+        )
+        if matrix is self.csr:
+            query_pos, target_pos = own_pos, other_pos
+        else:
+            query_pos, target_pos = other_pos, own_pos
+
+        if by == "query":
+            order = np.lexsort((target_pos, query_pos))
+        else:
+            order = np.lexsort((query_pos, target_pos))
+        return pd.DataFrame(
+            {
+                "query": np.asarray(query_genes)[query_pos[order]],
+                "target": np.asarray(target_genes)[target_pos[order]],
+                "degree": degree[order],
+            }
+        )
 
 # %% ../nbs/01_genes.ipynb #39751c8d
+# rank_genes_groups scores by gene and cell type, for the most recently used rankings
+_RANKED_SCORES = OrderedDict()
+_RANKED_SCORES_SIZE = 8
+
+
+def _ranked_scores(target: ad.AnnData) -> pd.DataFrame:
+    """
+    Index the `rank_genes_groups` scores of the target by gene and cell type. The index is built
+    once per ranking and reused as long as `target.uns["rank_genes_groups"]` is not replaced.
+
+    Parameters
+    ----------
+    target : ad.AnnData
+        Target annotation data.
+
+    Returns
+    -------
+    pd.DataFrame
+        The score of every ranked gene (rows) in every cell type (columns); NaN for genes that
+        were not ranked in a cell type.
+    """
+    ranking = target.uns["rank_genes_groups"]
+    key = id(ranking)
+    if key in _RANKED_SCORES and _RANKED_SCORES[key][0] is ranking:
+        _RANKED_SCORES.move_to_end(key)
+        return _RANKED_SCORES[key][1]
+
+    names = pd.DataFrame(ranking["names"])
+    scores = pd.DataFrame(ranking["scores"])
+    ranked = pd.concat(
+        {
+            celltype: pd.Series(scores[celltype].to_numpy(), index=names[celltype])
+            for celltype in names.columns
+        },
+        axis=1,
+    )
+    # keep a reference to the ranking, so that its id is not reused while it is cached
+    _RANKED_SCORES[key] = (ranking, ranked)
+    if len(_RANKED_SCORES) > _RANKED_SCORES_SIZE:
+        _RANKED_SCORES.popitem(last=False)
+    return ranked
+
+
+def get_orthologs_batch(
+    queries: List[Tuple[np.ndarray, str]],
+    orthology: Union[pd.DataFrame, OrthologyTable],
+    target: ad.AnnData,
+) -> List[np.ndarray]:
+    """
+    Get orthologous and paralogous gene connections for many gene lists and target cell types at
+    once, as `get_orthologs` would for each of them. All queries are answered from a single sparse
+    product and a single lookup into the (cached) `rank_genes_groups` scores.
+
+    Parameters
+    ----------
+    queries : List[Tuple[np.ndarray, str]]
+        Pairs of (genes, celltype_to); see `get_orthologs`.
+    orthology : Union[pd.DataFrame, OrthologyTable]
+        Data frame representing the orthology information, or an `OrthologyTable`; see
+        `get_orthologs`.
+    target : ad.AnnData
+        Target annotation data.
+
+    Returns
+    -------
+    List[np.ndarray]
+        The array of connections of every query, in the same order as `queries`. Columns are
+        (query, target, degree), where degree is 1 for paralogs and 2 for orthologs.
+    """
+    queries = [(np.asarray(genes), celltype_to) for genes, celltype_to in queries]
+    ranked = _ranked_scores(target)
+    celltypes = ranked.columns.get_indexer([celltype_to for _, celltype_to in queries])
+    if np.any(celltypes < 0):
+        unknown = [queries[i][1] for i in np.flatnonzero(celltypes < 0)]
+        raise KeyError(f"{unknown} not in rank_genes_groups")
+
+    # split every gene list into genes with and without orthology information
+    in_table = [orthology.index.get_indexer(genes) >= 0 for genes, _ in queries]
+    genes_in_table = [
+        np.unique(genes[found]) for (genes, _), found in zip(queries, in_table)
+    ]
+    not_in_table = [
+        np.unique(genes[~found]) for (genes, _), found in zip(queries, in_table)
+    ]
+    all_genes = np.unique(np.concatenate(genes_in_table + [np.array([], dtype=object)]))
+    if not isinstance(orthology, OrthologyTable):
+        orthology = OrthologyTable.from_dataframe(orthology.loc[all_genes])
+    scores = orthology.csr[orthology.index.get_indexer(all_genes)]
+    scores.data[scores.data < 0] = 0
+
+    # which genes belong to which query, and the total degree of every target gene per query
+    query_of = np.repeat(np.arange(len(queries)), [len(g) for g in genes_in_table])
+    gene_of = np.searchsorted(
+        all_genes, np.concatenate(genes_in_table + [np.array([], dtype=object)])
+    )
+    membership = sparse.csr_matrix(
+        (np.ones(len(gene_of), dtype=scores.dtype), (query_of, gene_of)),
+        shape=(len(queries), len(all_genes)),
+    )
+    totals = (membership @ scores).tocoo()
+
+    # orthologs have a total degree of 2, significant paralogs of 1
+    kind = np.where(totals.data == 2, 0, np.where(totals.data == 1, 1, -1))
+    homolog_names = np.asarray(orthology.columns, dtype=object)[totals.col]
+    in_target = pd.Index(target.var.index).get_indexer(homolog_names) >= 0
+    rows = ranked.index.get_indexer(homolog_names)
+    rank_scores = np.where(
+        rows >= 0, ranked.to_numpy()[rows, celltypes[totals.row]], np.nan
+    )
+    keep = in_target & ((kind == 0) | ((kind == 1) & (rank_scores > 0.01)))
+    order = np.lexsort((homolog_names[keep], kind[keep], totals.row[keep]))
+    selected = (totals.row[keep] * len(orthology.columns) + totals.col[keep])[order]
+
+    # the connections of every query, ordered by homolog and then by query gene
+    owner, positions = _gather(scores, gene_of)
+    entry_query = query_of[owner]
+    entry_gene = gene_of[owner]
+    entry_homolog = pd.Index(selected).get_indexer(
+        entry_query * len(orthology.columns) + scores.indices[positions]
+    )
+    degree = scores.data[positions]
+    keep = (entry_homolog >= 0) & (degree > 0)
+    order = np.lexsort((entry_gene[keep], entry_homolog[keep]))
+    entry_query = entry_query[keep][order]
+    connections = np.empty((len(order), 3), dtype=object)
+    connections[:, 0] = all_genes[entry_gene[keep][order]]
+    connections[:, 1] = np.asarray(orthology.columns, dtype=object)[
+        scores.indices[positions][keep][order]
+    ]
+    connections[:, 2] = degree[keep][order]
+
+    bounds = np.searchsorted(entry_query, np.arange(len(queries) + 1))
+    result = []
+    for i, unconnected in enumerate(not_in_table):
+        connected = connections[bounds[i] : bounds[i + 1]]
+        if unconnected.size > 0:
+            unconnected = np.array([[g, None, 0] for g in unconnected])
+            connected = np.concatenate((connected, unconnected))
+        result.append(connected)
+    return result
+
+
 def get_orthologs(
-    genes: np.ndarray, orthology: pd.DataFrame, target: ad.AnnData, celltype_to: str
+    genes: np.ndarray,
+    orthology: Union[pd.DataFrame, OrthologyTable],
+    target: ad.AnnData,
+    celltype_to: str,
 ) -> np.ndarray:
     """
     Get orthologous and paralogous gene connections based on the given genes and orthology
@@ -91,10 +533,10 @@ def get_orthologs(
     ----------
     genes : np.ndarray
         Array of gene names.
-    orthology : pd.DataFrame
+    orthology : Union[pd.DataFrame, OrthologyTable]
         Data frame representing the orthology information. The index should contain the query genes,
         the columns should overlap with the index of target.var, and the values should be 1 for
-        paralogs and 2 for orthologs.
+        paralogs and 2 for orthologs. An `OrthologyTable` is faster for large tables.
     target : ad.AnnData
         Target annotation data.
     celltype_to : str
@@ -106,32 +548,7 @@ def get_orthologs(
         Array of connections between genes, including orthologous and paralogous connections.
         Columns are (query, target, degree), where degree is 1 for paralogs and 2 for orthologs.
     """
-    genes_in_table = np.intersect1d(genes, orthology.index)
-
-    to_include = np.sum(orthology.loc[genes_in_table]) == 2
-    orthologs = np.intersect1d(orthology.columns[to_include], target.var.index)
-
-    to_include = np.sum(orthology.loc[genes_in_table]) == 1
-    paralogs = np.intersect1d(orthology.columns[to_include], target.var.index)
-
-    scores = pd.DataFrame(target.uns["rank_genes_groups"]["scores"])[celltype_to]
-    names = pd.DataFrame(target.uns["rank_genes_groups"]["names"])[celltype_to]
-
-    framed = pd.DataFrame(scores).set_index(names)
-    significant = framed.loc[paralogs] > 0.01
-    homologs = np.concatenate((orthologs, paralogs[significant[celltype_to]]))
-
-    subset = orthology.loc[genes_in_table][homologs].melt(ignore_index=False)
-    subset.reset_index(drop=False, inplace=True)
-
-    connections = np.array(subset[subset["value"] > 0])
-
-    not_in_table = np.setdiff1d(genes, orthology.index)
-    if not_in_table.size > 0:
-        unconnected = np.array([[g, None, 0] for g in not_in_table])
-        return np.concatenate((connections, unconnected))
-    else:
-        return connections
+    return get_orthologs_batch([(genes, celltype_to)], orthology, target)[0]
 
 
 def get_orthologs_overlap(genes1, genes2, query, target, orthology):
@@ -149,8 +566,8 @@ def get_orthologs_overlap(genes1, genes2, query, target, orthology):
         An AnnData object containing the query genes as indices of the `.var` slot.
     target : anndata.AnnData
         An AnnData object containing the target genes as indices of the `.var` slot.
-    orthology : pandas.core.frame.DataFrame
-        A DataFrame containing the orthology information.
+    orthology : Union[pandas.core.frame.DataFrame, OrthologyTable]
+        A DataFrame containing the orthology information, or an `OrthologyTable`.
 
     Returns
     -------
@@ -164,15 +581,163 @@ def get_orthologs_overlap(genes1, genes2, query, target, orthology):
     genes1_in_table = np.intersect1d(genes1_in_data, orthology.index)
     genes2_in_table = np.intersect1d(genes2_in_data, orthology.columns)
 
-    connections = []
+    if not isinstance(orthology, OrthologyTable):
+        orthology = OrthologyTable.from_dataframe(
+            orthology.loc[genes1_in_table, genes2_in_table]
+        )
+    pairs = orthology.homologs(genes1_in_table, genes2_in_table)
+    pairs = pd.concat([pairs[pairs["degree"] == 2], pairs[pairs["degree"] == 1]])
+    if len(pairs) == 0:
+        return np.array([])
 
-    subset = orthology.loc[genes1_in_table][genes2_in_table]
-    _qo, _to = np.where(subset == 2)
-    for q, t in zip(subset.index[_qo], subset.columns[_to]):
-        connections.append([q, t, "2"])
+    return np.array(
+        [pairs["query"], pairs["target"], pairs["degree"].astype(str)], dtype=str
+    ).T
 
-    _qo, _to = np.where(subset == 1)
-    for q, t in zip(subset.index[_qo], subset.columns[_to]):
-        connections.append([q, t, "1"])
 
-    return np.array(connections)
+def _marker_membership(
+    markers: dict, genes: pd.Index, available: pd.Index
+) -> sparse.csr_matrix:
+    """
+    Encode marker sets as a sparse clusters$\\times$genes membership matrix.
+
+    Parameters
+    ----------
+    markers : dict
+        The marker genes of every cluster.
+    genes : pd.Index
+        The genes of the orthology table, one per column of the result.
+    available : pd.Index
+        The genes present in the data; other markers are ignored.
+
+    Returns
+    -------
+    sparse.csr_matrix
+        A matrix with a 1 for every marker gene of every cluster.
+    """
+    cluster_of, gene_of = [], []
+    for i, cluster_markers in enumerate(markers.values()):
+        cluster_markers = np.asarray(cluster_markers)
+        cluster_markers = cluster_markers[available.get_indexer(cluster_markers) >= 0]
+        found = genes.get_indexer(cluster_markers)
+        found = np.unique(found[found >= 0])
+        cluster_of.append(np.full(len(found), i))
+        gene_of.append(found)
+    cluster_of = np.concatenate(cluster_of + [np.array([], dtype=int)])
+    gene_of = np.concatenate(gene_of + [np.array([], dtype=int)])
+    return sparse.csr_matrix(
+        (np.ones(len(gene_of), dtype=np.int64), (cluster_of, gene_of)),
+        shape=(len(markers), len(genes)),
+    )
+
+
+def get_orthologs_overlap_matrix(
+    query_markers: dict,
+    target_markers: dict,
+    query: ad.AnnData,
+    target: ad.AnnData,
+    orthology: Union[pd.DataFrame, OrthologyTable],
+    return_pairs: bool = False,
+):
+    """
+    Count the homologous gene pairs between the marker genes of every query cluster and every
+    target cluster, as `get_orthologs_overlap` would find for each pair of clusters. The counts
+    come from sparse products of the cluster$\\times$gene marker matrices and the orthology table.
+
+    Parameters
+    ----------
+    query_markers : dict
+        The marker genes (e.g. from `rank_genes_groups`) of every query cluster.
+    target_markers : dict
+        The marker genes of every target cluster.
+    query : anndata.AnnData
+        An AnnData object containing the query genes as indices of the `.var` slot.
+    target : anndata.AnnData
+        An AnnData object containing the target genes as indices of the `.var` slot.
+    orthology : Union[pandas.core.frame.DataFrame, OrthologyTable]
+        A DataFrame containing the orthology information, or an `OrthologyTable`.
+    return_pairs : bool, optional
+        If True, also return the homologous gene pairs of every pair of clusters (default: False).
+
+    Returns
+    -------
+    orthologs : pandas.core.frame.DataFrame
+        The number of orthologous (degree 2) gene pairs, with query clusters as rows and target
+        clusters as columns.
+    paralogs : pandas.core.frame.DataFrame
+        The number of paralogous (degree 1) gene pairs, in the same layout.
+    pairs : pandas.core.frame.DataFrame
+        Only if `return_pairs` is True. The homologous gene pairs, with columns 'query_cluster',
+        'target_cluster', 'query', 'target', and 'degree'. The pairs of every pair of clusters
+        are in the same order as in `get_orthologs_overlap`.
+    """
+    if not isinstance(orthology, OrthologyTable):
+        # either side may have no clusters at all
+        empty = [np.array([], dtype=object)]
+        all_query = np.unique(
+            np.concatenate([np.asarray(m) for m in query_markers.values()] + empty)
+        )
+        all_target = np.unique(
+            np.concatenate([np.asarray(m) for m in target_markers.values()] + empty)
+        )
+        orthology = OrthologyTable.from_dataframe(
+            orthology.loc[
+                np.intersect1d(all_query, orthology.index),
+                np.intersect1d(all_target, orthology.columns),
+            ]
+        )
+    query_members = _marker_membership(query_markers, orthology.index, query.var.index)
+    target_members = _marker_membership(
+        target_markers, orthology.columns, target.var.index
+    )
+    query_clusters = pd.Index(list(query_markers.keys()))
+    target_clusters = pd.Index(list(target_markers.keys()))
+
+    counts = []
+    for degree in [2, 1]:
+        at_degree = (orthology.csr == degree).astype(np.int64)
+        overlap = query_members @ at_degree @ target_members.T
+        counts.append(
+            pd.DataFrame(
+                overlap.toarray(), index=query_clusters, columns=target_clusters
+            )
+        )
+    if not return_pairs:
+        return counts[0], counts[1]
+
+    # expand every query marker to its homologs, and every homolog to the target clusters it is
+    # a marker of
+    query_members = query_members.tocoo()
+    owner, entries = _gather(orthology.csr, query_members.col)
+    degree = orthology.csr.data[entries]
+    keep = (degree == 1) | (degree == 2)
+    query_cluster = query_members.row[owner][keep]
+    query_gene = query_members.col[owner][keep]
+    target_gene = orthology.csr.indices[entries][keep]
+    degree = degree[keep]
+    target_clusters_of = target_members.T.tocsr()
+    owner, entries = _gather(target_clusters_of, target_gene)
+    query_cluster, query_gene, target_gene, degree = (
+        query_cluster[owner],
+        query_gene[owner],
+        target_gene[owner],
+        degree[owner],
+    )
+    target_cluster = target_clusters_of.indices[entries]
+
+    # like `get_orthologs_overlap`: orthologs first, then paralogs, each sorted by gene names
+    query_names = np.asarray(orthology.index, dtype=object)[query_gene]
+    target_names = np.asarray(orthology.columns, dtype=object)[target_gene]
+    order = np.lexsort(
+        (target_names, query_names, -degree, target_cluster, query_cluster)
+    )
+    pairs = pd.DataFrame(
+        {
+            "query_cluster": query_clusters[query_cluster[order]],
+            "target_cluster": target_clusters[target_cluster[order]],
+            "query": query_names[order],
+            "target": target_names[order],
+            "degree": degree[order],
+        }
+    )
+    return counts[0], counts[1], pairs
@@ -3,28 +3,27 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/02_plot.ipynb.
 
 # %% auto #0
-__all__ = ['highlighted_dimplot', 'highlighted_heatmap', 'annotated_heatmap', 'paired_dotplot']
+__all__ = ['highlighted_dimplot', 'highlighted_heatmap', 'annotated_heatmap', 'paired_dotplot', 'batch_paired_dotplot']
 
 # %% ../nbs/02_plot.ipynb #d3a3c311
 import os
-import pickle
-from typing import Any, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Any, Callable, Mapping, Tuple, Union
 
-import scanpy as sc
 import anndata as ad
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.colors import Colormap
 import numpy as np
 import pandas as pd
-import plotly
-import plotly.express as px
-import plotly.figure_factory as ff
-import plotly.graph_objects as go
-import seaborn as sns
 from matplotlib.patches import Circle, Rectangle
-from plotly.subplots import make_subplots
-from samap import SAMAP
+
+# scanpy, seaborn and plotly are imported by the functions that need them, so that importing this
+# module stays fast; samap is only needed for type hints
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+    from samap import SAMAP
 
 from . import dotplot_util as du
 from . import genes, util
@@ -66,9 +65,12 @@ def highlighted_dimplot(
     -------
     None
     """
-    cluster_cells = adata.obs[clustering] == cluster.replace(species + "_", "")
+    import scanpy as sc
+
+    cluster = cluster.replace(species + "_", "")
+    cluster_cells = adata.obs[clustering] == cluster
     coords = adata.obsm[embedding][cluster_cells]
-    cx, cy = util.find_center(coords)
+    cx, cy = util.find_centers(adata, clustering, embedding=embedding).loc[cluster]
     radius = np.mean(np.std(coords, axis=0))
     if radius < 0.5:
         radius = 0.5
@@ -115,6 +117,8 @@ def highlighted_heatmap(to_plot, celltype_from, celltype_to, figheight=20, save=
     -------
     None
     """
+    import seaborn as sns
+
     figwidth = int(to_plot.shape[0] / to_plot.shape[1] * figheight)
     y = np.where(to_plot.columns == celltype_from)[0][0]
     x = np.where(to_plot.index == celltype_to)[0][0]
@@ -149,6 +153,8 @@ def _plot_clustermap(
     save,
     **kwargs,
 ):
+    import seaborn as sns
+
     if figsize is None:
         figsize = np.array(similarity.shape) / 3
 
@@ -188,7 +194,8 @@ def _plot_clustermap(
     )
 
     if save is not None:
-        plt.savefig(save)
+        with util.profile_stage("savefig"):
+            plt.savefig(save)
 
 # %% ../nbs/02_plot.ipynb #69ab7c66
 def _plotly_clustermap(
@@ -203,6 +210,9 @@ def _plotly_clustermap(
     save,
     dpi=300,
 ):
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
     query_colors = query_map.set_index(query_clustering)
     query_colors["cc"] = pd.Categorical(query_colors[query_coarse])
     query_colors["code"] = query_colors.cc.cat.codes
@@ -267,14 +277,15 @@ def _plotly_clustermap(
         fig.update_layout(width=figsize[0] * dpi, height=figsize[1] * dpi)
 
     if save is not None:
-        fig.write_html(save + ".html")
-        fig.write_json(save + ".json")
+        with util.profile_stage("savefig"):
+            fig.write_html(save + ".html")
+            fig.write_json(save + ".json")
 
     return fig
 
 # %% ../nbs/02_plot.ipynb #35e2f1e1
 def annotated_heatmap(
-    sm: SAMAP,  # SAMAP object
+    sm: "SAMAP",  # SAMAP object
     similarity: pd.DataFrame,  # Similarity matrix. Contains query species clusters as columns and target species clusters as rows.
     query_species: str,  # Query species ID. Will be used in the title. Should prepend the similarity matrix column names.
     target_species: str,  # Target species ID. Will be used in the title. Should prepend the similarity matrix row names.
@@ -293,60 +304,242 @@ def annotated_heatmap(
     save: Union[
         str, None
     ] = None,  # If not None, will save the figure to the specified path (default: None).
+    profile: Union[
+        bool, Callable[[dict], None]
+    ] = False,  # Whether to record the wall time, memory peak and input sizes of every stage. If True, the records are returned as a dataframe, after the figure if there is one; a function is called with every record instead (default: False).
     **kwargs: Any,  # Additional arguments to pass to `seaborn.heatmap` (matplotlib) or `plotly.graph_objects.Figure` (plotly). Among them: dpi (int), which is only used if `interactive=True` to set the figure size in pixels.
 ) -> Union[
-    None, plotly.graph_objects.Figure
-]:  # return None if `interactive=False`, otherwise return a plotly figure.
+    None, "go.Figure", pd.DataFrame, Tuple["go.Figure", pd.DataFrame]
+]:  # return None if `interactive=False`, otherwise return a plotly figure; with `profile=True`, the stage records as well.
     "Plot the similarity matrix as an annotated heatmap."
     if query_coarse is None:
         query_coarse = query_clustering
     if target_coarse is None:
         target_coarse = target_clustering
 
-    query_map, query_lut, query_handles = util.map_fine_to_coarse(
-        sm, query_species, query_clustering, query_coarse
-    )
-    target_map, target_lut, target_handles = util.map_fine_to_coarse(
-        sm, target_species, target_clustering, target_coarse
-    )
+    sizes = {
+        "cells": sm.sams[query_species].adata.n_obs
+        + sm.sams[target_species].adata.n_obs,
+        "clusters": similarity.shape[0] + similarity.shape[1],
+    }
+    with util.profiling(profile) as profiler:
+        with util.profile_stage("cluster colors", **sizes):
+            query_map, query_lut, query_handles = util.map_fine_to_coarse(
+                sm, query_species, query_clustering, query_coarse
+            )
+            target_map, target_lut, target_handles = util.map_fine_to_coarse(
+                sm, target_species, target_clustering, target_coarse
+            )
+
+            query_map[query_coarse] = query_map[query_coarse].replace(
+                to_replace=query_lut
+            )
+            target_map[target_coarse] = target_map[target_coarse].replace(
+                to_replace=target_lut
+            )
+
+        with util.profile_stage("heatmap", **sizes):
+            if not interactive:
+                figure = _plot_clustermap(
+                    similarity,
+                    query_map,
+                    target_map,
+                    query_handles,
+                    target_handles,
+                    query_lut,
+                    target_lut,
+                    query_species,
+                    target_species,
+                    query_clustering,
+                    target_clustering,
+                    query_coarse,
+                    target_coarse,
+                    figsize,
+                    save,
+                    **kwargs,
+                )
+            else:
+                figure = _plotly_clustermap(
+                    similarity,
+                    query_map,
+                    target_map,
+                    query_clustering,
+                    target_clustering,
+                    query_coarse,
+                    target_coarse,
+                    figsize,
+                    save,
+                    **kwargs,
+                )
+
+    if profile is True:
+        records = profiler.to_frame()
+        return records if figure is None else (figure, records)
+    return figure
 
-    query_map[query_coarse] = query_map[query_coarse].replace(to_replace=query_lut)
-    target_map[target_coarse] = target_map[target_coarse].replace(to_replace=target_lut)
-
-    if not interactive:
-        return _plot_clustermap(
-            similarity,
-            query_map,
-            target_map,
-            query_handles,
-            target_handles,
-            query_lut,
-            target_lut,
-            query_species,
-            target_species,
-            query_clustering,
-            target_clustering,
-            query_coarse,
-            target_coarse,
-            figsize,
-            save,
-            **kwargs,
+# %% ../nbs/02_plot.ipynb #73368801
+def _paired_dotplot_data(
+    query: ad.AnnData,
+    target: ad.AnnData,
+    connections: np.array,
+    query_clustering: str,
+    target_clustering: str,
+    query_cluster: Union[str, None] = None,
+    target_cluster: Union[str, None] = None,
+    pad: bool = True,
+    query_gene_names: Union[str, None] = None,
+    target_gene_names: Union[str, None] = None,
+    scale: bool = False,
+    layer: Union[str, None] = None,
+    cache: Union[util.GroupedStatsCache, None] = None,
+    transform: Union[str, None] = None,
+    query_stats: Union[Tuple[util.GroupedStats, util.GroupedStats], None] = None,
+    target_stats: Union[Tuple[util.GroupedStats, util.GroupedStats], None] = None,
+) -> Union[dict, None]:
+    """
+    Prepare the dot tables, gene order and colors of a paired dotplot; None if a side has no genes.
+    `query_stats` and `target_stats` hold the statistics of all genes of each side for the averages
+    and for the expressing cells, see `_batch_stats`; if given, they are subset instead of reduced or
+    looked up in `cache`.
+    """
+    # make a local copy, since connections is mutable
+    # and we might change it inadvertently
+    links = connections.copy()
+    # demultiplex the connected genes
+    query_genes = du.unique_genes(links[:, 0])
+    target_genes = du.unique_genes(links[:, 1])
+
+    sizes = {
+        "cells": query.n_obs + target.n_obs,
+        "genes": len(query_genes) + len(target_genes),
+        "connections": len(links),
+    }
+    with util.profile_stage("grouped stats", **sizes):
+        if query_stats is not None and target_stats is not None:
+            query_avg_expr, query_perc_expr = du._dot_frames(
+                query, *query_stats, query_genes, query_gene_names
+            )
+            target_avg_expr, target_perc_expr = du._dot_frames(
+                target, *target_stats, target_genes, target_gene_names
+            )
+        else:
+            # get average expression for each dot
+            query_avg_expr, target_avg_expr = du.get_dot_color(
+                query,
+                target,
+                query_clustering,
+                target_clustering,
+                query_genes=query_genes,
+                target_genes=target_genes,
+                query_gene_names=query_gene_names,
+                target_gene_names=target_gene_names,
+                layer=layer,
+                cache=cache,
+                transform=transform,
+            )
+            # get expression percentage for each dot
+            query_perc_expr, target_perc_expr = du.get_dot_size(
+                query,
+                target,
+                query_clustering,
+                target_clustering,
+                query_genes=query_genes,
+                target_genes=target_genes,
+                query_gene_names=query_gene_names,
+                target_gene_names=target_gene_names,
+                cache=cache,
+            )
+        # scale the expression values to be between 0 and 1 for each gene
+        if scale:
+            query_avg_expr = util.rescale(query_avg_expr.T).fillna(0).T
+            target_avg_expr = util.rescale(target_avg_expr.T).fillna(0).T
+
+    with util.profile_stage("gene names", **sizes):
+        # replace gene IDs with gene names, if so chosen
+        if query_gene_names is not None:
+            for i, gene in enumerate(links[:, 0]):
+                if gene is not None:
+                    links[i, 0] = query.var[query_gene_names].loc[gene]
+            query_genes = du.unique_genes(links[:, 0])
+        if target_gene_names is not None:
+            for i, gene in enumerate(links[:, 1]):
+                if gene is not None:
+                    links[i, 1] = target.var[target_gene_names].loc[gene]
+            target_genes = du.unique_genes(links[:, 1])
+
+        # pad gene names with spaces to make plotting more beautiful
+        if pad:
+            query_genes = np.array(
+                [util.procrustes(g[:50], 50, side="right") for g in query_genes]
+            )
+            target_genes = np.array(
+                [util.procrustes(g[:50], 50, side="left") for g in target_genes]
+            )
+            for i, g in enumerate(links[:, 0]):
+                if g is not None:
+                    links[i, 0] = util.procrustes(g[:50], 50, side="right")
+            for i, g in enumerate(links[:, 1]):
+                if g is not None:
+                    links[i, 1] = util.procrustes(g[:50], 50, side="left")
+
+    sizes["clusters"] = len(query_avg_expr) + len(target_avg_expr)
+    with util.profile_stage("gene order", **sizes):
+        # keep track of what the clusters are:
+        query_clusters = np.sort(query_avg_expr.index.values)
+        target_clusters = np.sort(target_avg_expr.index.values)
+
+        # reorder alphabetically so that both tables are oriented exactly the same way
+        query_perc_expr = query_perc_expr.loc[query_clusters]
+        query_avg_expr = query_avg_expr.loc[query_clusters]
+        target_perc_expr = target_perc_expr.loc[target_clusters]
+        target_avg_expr = target_avg_expr.loc[target_clusters]
+
+        # highlight target and query clusters to make inspecting the dotplot easier
+        query_clust_col = du.highlight_cluster(query_clusters, query_cluster)
+        target_clust_col = du.highlight_cluster(target_clusters, target_cluster)
+
+        # convert the links to an adjacency matrix and use it to find an optimal
+        # plotting order for the query/target genes
+        adj_matrix = du.calculate_adjacency_matrix(
+            links, query_genes, target_genes, sparse_output=True
         )
-    else:
-        return _plotly_clustermap(
-            similarity,
-            query_map,
-            target_map,
-            query_clustering,
-            target_clustering,
-            query_coarse,
-            target_coarse,
-            figsize,
-            save,
-            **kwargs,
+        _no_components, components = du.connected_components(adj_matrix, directed=False)
+        query_order, target_order = du.gene_order(
+            adj_matrix, components, len(query_genes)
         )
 
-# %% ../nbs/02_plot.ipynb #73368801
+        query_comp_color, target_comp_color = du.feature_colors(
+            components, len(query_genes)
+        )
+
+        query_genes = query_genes[query_order]
+        query_comp_color = query_comp_color[query_order]
+        target_genes = target_genes[target_order]
+        target_comp_color = target_comp_color[target_order]
+        # don't forget to reorder the genes and colors according to the optimal order.
+        # Thanks to Phil for helping me figure this out and debug it!
+        query_avg_expr = query_avg_expr.iloc[:, query_order]
+        target_avg_expr = target_avg_expr.iloc[:, target_order]
+        query_perc_expr = query_perc_expr.iloc[:, query_order]
+        target_perc_expr = target_perc_expr.iloc[:, target_order]
+
+    if len(target_genes) == 0 or len(query_genes) == 0:
+        return None
+    return {
+        "query_avg_expr": query_avg_expr,
+        "target_avg_expr": target_avg_expr,
+        "query_perc_expr": query_perc_expr,
+        "target_perc_expr": target_perc_expr,
+        "query_genes": query_genes,
+        "target_genes": target_genes,
+        "connections": links,
+        "query_cluster_colors": query_clust_col,
+        "target_cluster_colors": target_clust_col,
+        "query_gene_colors": query_comp_color,
+        "target_gene_colors": target_comp_color,
+    }
+
+
 def paired_dotplot(
     query: ad.AnnData,  # query species AnnData object
     target: ad.AnnData,  # target species AnnData object
@@ -377,132 +570,250 @@ def paired_dotplot(
     title_font_size: float = 16,  # font size of the overall plot title (default: 16).
     scale: bool = False,  # whether to scale the expression values to be between 0 and 1 for each gene (default: False).
     cmap: Colormap = "magma_r",  # colormap to use for the dotplot (default: "viridis").
-    layer: Union[str, None] = None,  # layer : Union[str, None], optional The layer to use for the average expression calculation. If not specified, it will use the `.X` slot of the `AnnData` objects. It is vital to set this correctly to avoid calculating average expression on log1p-transformed data (default: None).
-) -> None:
-    # make a local copy, since connections is mutable
-    # and we might change it inadvertently
-    links = connections.copy()
-    # demultiplex the connected genes
-    query_genes = du.unique_genes(links[:, 0])
-    target_genes = du.unique_genes(links[:, 1])
-
-    # get average expression for each dot
-    query_avg_expr, target_avg_expr = du.get_dot_color(
-        query,
-        target,
-        query_clustering,
-        target_clustering,
-        query_genes=query_genes,
-        target_genes=target_genes,
-        query_gene_names=query_gene_names,
-        target_gene_names=target_gene_names,
-        layer=layer,
-    )
-    # scale the expression values to be between 0 and 1 for each gene
-    if scale:
-        query_avg_expr = util.rescale(query_avg_expr.T).fillna(0).T
-        target_avg_expr = util.rescale(target_avg_expr.T).fillna(0).T
-    # get expression percentage for each dot
-    query_perc_expr, target_perc_expr = du.get_dot_size(
-        query,
-        target,
-        query_clustering,
-        target_clustering,
-        query_genes=query_genes,
-        target_genes=target_genes,
-        query_gene_names=query_gene_names,
-        target_gene_names=target_gene_names,
-    )
-
-    # replace gene IDs with gene names, if so chosen
-    if query_gene_names is not None:
-        for i, gene in enumerate(links[:, 0]):
-            if gene is not None:
-                links[i, 0] = query.var[query_gene_names].loc[gene]
-        query_genes = du.unique_genes(links[:, 0])
-    if target_gene_names is not None:
-        for i, gene in enumerate(links[:, 1]):
-            if gene is not None:
-                links[i, 1] = target.var[target_gene_names].loc[gene]
-        target_genes = du.unique_genes(links[:, 1])
-
-    # pad gene names with spaces to make plotting more beautiful
-    if pad:
-        query_genes = np.array(
-            [util.procrustes(g[:50], 50, side="right") for g in query_genes]
-        )
-        target_genes = np.array(
-            [util.procrustes(g[:50], 50, side="left") for g in target_genes]
+    layer: Union[
+        str, None
+    ] = None,  # layer : Union[str, None], optional The layer to use for the average expression calculation. If not specified, it will use the `.X` slot of the `AnnData` objects. It is vital to set this correctly to avoid calculating average expression on log1p-transformed data (default: None).
+    cache: Union[
+        util.GroupedStatsCache, None
+    ] = None,  # cache of grouped statistics, e.g. `util.grouped_stats_cache`. Speeds up repeated calls on the same datasets and clusterings by calculating the statistics only once (default: None).
+    profile: Union[
+        bool, Callable[[dict], None]
+    ] = False,  # whether to record the wall time, memory peak and input sizes (cells, genes, clusters, connections) of every stage. If True, the records are returned as a dataframe; a function is called with every record instead (default: False).
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before averaging. Set it to "expm1" to average log1p-normalised data in linear space, without a counts layer or a dense copy of the matrix (default: None).
+) -> Union[None, pd.DataFrame]:  # None, or the stage records if `profile=True`.
+    with util.profiling(profile) as profiler:
+        dotplot = _paired_dotplot_data(
+            query,
+            target,
+            connections,
+            query_clustering,
+            target_clustering,
+            query_cluster=query_cluster,
+            target_cluster=target_cluster,
+            pad=pad,
+            query_gene_names=query_gene_names,
+            target_gene_names=target_gene_names,
+            scale=scale,
+            layer=layer,
+            cache=cache,
+            transform=transform,
         )
-        for i, g in enumerate(links[:, 0]):
-            if g is not None:
-                links[i, 0] = util.procrustes(g[:50], 50, side="right")
-        for i, g in enumerate(links[:, 1]):
-            if g is not None:
-                links[i, 1] = util.procrustes(g[:50], 50, side="left")
-
-    # keep track of what the clusters are:
-    query_clusters = np.sort(query_avg_expr.index.values)
-    target_clusters = np.sort(target_avg_expr.index.values)
-
-    # reorder alphabetically so that both tables are oriented exactly the same way
-    query_perc_expr = query_perc_expr.loc[query_clusters]
-    query_avg_expr = query_avg_expr.loc[query_clusters]
-    target_perc_expr = target_perc_expr.loc[target_clusters]
-    target_avg_expr = target_avg_expr.loc[target_clusters]
-
-    # highlight target and query clusters to make inspecting the dotplot easier
-    query_clust_col = du.highlight_cluster(query_clusters, query_cluster)
-    target_clust_col = du.highlight_cluster(target_clusters, target_cluster)
-
-    # convert the links to an adjacency matrix and use it to find an optimal
-    # plotting order for the query/target genes
-    adj_matrix = du.calculate_adjacency_matrix(links, query_genes, target_genes)
-    _no_components, components = du.connected_components(adj_matrix, directed=False)
-    query_order, target_order = du.gene_order(adj_matrix, components, len(query_genes))
-
-    query_comp_color, target_comp_color = du.feature_colors(
-        components, len(query_genes)
+        if dotplot is not None:
+            du.plot_dotplot(
+                **dotplot,
+                query_species=query_species,
+                target_species=target_species,
+                x_offset=x_offset,
+                y_offset=y_offset,
+                grid_offset=grid_offset,
+                query_clustering=query_clustering,
+                target_clustering=target_clustering,
+                output=output,
+                center=center,
+                title=title,
+                title_font_size=title_font_size,
+                cmap=cmap,
+            )
+    if profile is True:
+        return profiler.to_frame()
+
+# %% ../nbs/02_plot.ipynb #4473364b
+def _render_dotplot(
+    job: Tuple[
+        dict, Union[dict, None]
+    ],  # keyword arguments of `dotplot_util.plot_dotplot`, and those of a `util.Profiler` that records the stages, or None
+) -> list:  # the stage records, if a profiler was requested
+    "Render and save a single paired dotplot, then release its figure."
+    arguments, profile = job
+    with util.Profiler(**profile) if profile is not None else nullcontext() as profiler:
+        du.plot_dotplot(**arguments)
+    plt.close("all")
+    return [] if profiler is None else profiler.records
+
+
+@contextmanager
+def _headless():
+    "Render with the non-interactive Agg backend, as the worker processes do, then switch back."
+    backend = mpl.get_backend()
+    plt.switch_backend("agg")
+    try:
+        yield
+    finally:
+        plt.switch_backend(backend)
+
+
+def _batch_stats(
+    adata: ad.AnnData,  # dataset of one side
+    clustering: str,  # `.obs` column with the clustering
+    cache: util.GroupedStatsCache,  # cache that calculates the statistics of all genes once
+    layer: Union[str, None] = None,  # layer of the average expression
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before averaging, e.g. "expm1"
+) -> Tuple[
+    util.GroupedStats, util.GroupedStats
+]:  # the statistics for the averages, and those for the expressing cells
+    "Resolve the statistics of all genes of one side of a batch, which every pair then subsets."
+    mean_stats = cache.stats(adata, clustering, layer=layer, transform=transform)
+    # `get_dot_size` counts the expressing cells in `.X`; a transform does not change which
+    # values are zero, so only a layer needs separate statistics
+    if layer is None:
+        return mean_stats, mean_stats
+    return mean_stats, cache.stats(adata, clustering)
+
+
+def _strip_species(
+    label: str,  # cluster label of the similarity matrix
+    species: str,  # species ID that may prepend the label
+) -> str:  # the label without the species prefix
+    "Remove the species ID that SAMap prepends to cluster names."
+    prefix = f"{species}_"
+    return label[len(prefix) :] if label.startswith(prefix) else label
+
+
+def batch_paired_dotplot(
+    similarity: pd.DataFrame,  # Similarity matrix. Contains query species clusters as columns and target species clusters as rows.
+    query: ad.AnnData,  # query species AnnData object
+    target: ad.AnnData,  # target species AnnData object
+    connections: Union[
+        Callable[[str, str], np.ndarray], Mapping[Tuple[str, str], np.ndarray]
+    ],  # source of the connected genes of every pair: either a function that takes the query and target cluster names and returns an array of connections (see `paired_dotplot`), or a mapping from `(query_cluster, target_cluster)` to such an array.
+    query_clustering: str,  # `.obs` column in the query AnnData object containing the query species clustering.
+    target_clustering: str,  # `.obs` column in the target AnnData object containing the target species clustering.
+    query_species: str,  # query species ID. If it prepends the similarity matrix column names (as in SAMap), it is stripped to get the cluster names.
+    target_species: str,  # target species ID. If it prepends the similarity matrix row names (as in SAMap), it is stripped to get the cluster names.
+    threshold: float = 0.1,  # plot all pairs with a similarity greater than this (default: 0.1).
+    output_dir: str = ".",  # directory to save the plots to (default: ".").
+    pad: bool = True,  # whether to pad the gene names with spaces to make them all of a similar length (default: True).
+    query_gene_names: Union[
+        str, None
+    ] = None,  # `.var` column that holds unique gene names for the query species (default: None).
+    target_gene_names: Union[
+        str, None
+    ] = None,  # `.var` column that holds unique gene names for the target species (default: None).
+    scale: bool = False,  # whether to scale the expression values to be between 0 and 1 for each gene (default: False).
+    layer: Union[
+        str, None
+    ] = None,  # layer to use for the average expression calculation. If not specified, it will use the `.X` slot of the `AnnData` objects (default: None).
+    cache: Union[
+        util.GroupedStatsCache, None
+    ] = None,  # cache of grouped statistics. If None, a new cache is used for this batch, so that the statistics are calculated only once (default: None).
+    n_jobs: int = 1,  # number of worker processes that render the plots; -1 uses all cores (default: 1).
+    profile: Union[
+        bool, Callable[[dict], None]
+    ] = False,  # whether to record the wall time, memory peak and input sizes of every stage of every plot; the records carry the cluster pair. If True, the records are returned as a second dataframe; a function is called with every record instead (default: False).
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before averaging, e.g. "expm1" for log1p-normalised data; see `paired_dotplot` (default: None).
+    **kwargs: Any,  # Additional arguments to pass to `dotplot_util.plot_dotplot`, such as `x_offset`, `grid_offset`, `title_font_size` or `cmap`.
+) -> Union[
+    pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]
+]:  # The plotted pairs with their similarity and the path of the plot; the path is None if one side had no genes to plot. With `profile=True`, the stage records as well.
+    "Plot a paired dotplot for every cluster pair of the similarity matrix above a threshold."
+    if cache is None:
+        # keep the statistics of both clusterings for this batch only
+        cache = util.GroupedStatsCache()
+    os.makedirs(output_dir, exist_ok=True)
+
+    values = similarity.to_numpy()
+    rows, columns = np.nonzero(values > threshold)
+    order = np.argsort(-values[rows, columns], kind="stable")
+    rows, columns = rows[order], columns[order]
+    pairs = pd.DataFrame(
+        {
+            "query_cluster": similarity.columns[columns],
+            "target_cluster": similarity.index[rows],
+            "similarity": values[rows, columns],
+            "output": None,
+        }
     )
 
-    query_genes = query_genes[query_order]
-    query_comp_color = query_comp_color[query_order]
-    target_genes = target_genes[target_order]
-    target_comp_color = target_comp_color[target_order]
-    # don't forget to reorder the genes and colors according to the optimal order.
-    # Thanks to Phil for helping me figure this out and debug it!
-    query_avg_expr = query_avg_expr.iloc[:, query_order]
-    target_avg_expr = target_avg_expr.iloc[:, target_order]
-    query_perc_expr = query_perc_expr.iloc[:, query_order]
-    target_perc_expr = target_perc_expr.iloc[:, target_order]
-
-    if len(target_genes) > 0 and len(query_genes) > 0:
-        du.plot_dotplot(
-            query_avg_expr,
-            target_avg_expr,
-            query_perc_expr,
-            target_perc_expr,
-            query_genes,
-            target_genes,
-            links,
-            query_clust_col,
-            target_clust_col,
-            query_comp_color,
-            target_comp_color,
-            query_species,
-            target_species,
-            x_offset=x_offset,
-            y_offset=y_offset,
-            grid_offset=grid_offset,
-            query_clustering=query_clustering,
-            target_clustering=target_clustering,
-            output=output,
-            center=center,
-            title=title,
-            title_font_size=title_font_size,
-            cmap=cmap,
-        )
-    else:
-        pass
-
-    # return query_avg_expr, target_avg_expr
+    def jobs(profiler: Union[util.Profiler, None]):
+        # prepare the plots in this process; the workers only need the small dot tables
+        for i, (query_label, target_label) in enumerate(
+            zip(pairs["query_cluster"], pairs["target_cluster"])
+        ):
+            query_cluster = _strip_species(str(query_label), query_species)
+            target_cluster = _strip_species(str(target_label), target_species)
+            if callable(connections):
+                links = connections(query_cluster, target_cluster)
+            else:
+                links = connections[(query_cluster, target_cluster)]
+            pair_profiler = nullcontext()
+            if profiler is not None:
+                pair_profiler = profiler.child(
+                    query_cluster=query_cluster, target_cluster=target_cluster
+                )
+            with pair_profiler:
+                dotplot = _paired_dotplot_data(
+                    query,
+                    target,
+                    np.asarray(links, dtype=object),
+                    query_clustering,
+                    target_clustering,
+                    query_cluster=query_cluster,
+                    target_cluster=target_cluster,
+                    pad=pad,
+                    query_gene_names=query_gene_names,
+                    target_gene_names=target_gene_names,
+                    scale=scale,
+                    layer=layer,
+                    query_stats=query_stats,
+                    target_stats=target_stats,
+                )
+            if dotplot is None:
+                continue
+            name = f"{query_cluster}_{target_cluster}.png".replace(os.sep, "-")
+            output = os.path.join(output_dir, name)
+            pairs.at[i, "output"] = output
+            job_profile = None
+            if profiler is not None:
+                job_profile = {"memory": profiler.memory, **pair_profiler.context}
+            yield (
+                {
+                    **dotplot,
+                    "query_species": query_species,
+                    "target_species": target_species,
+                    "query_clustering": query_clustering,
+                    "target_clustering": target_clustering,
+                    "output": output,
+                    **kwargs,
+                },
+                job_profile,
+            )
+
+    with util.profiling(profile) as profiler:
+        query_stats, target_stats = None, None
+        if len(pairs) > 0:
+            # reduce each matrix once; every pair only subsets the statistics of all genes
+            with util.profile_stage(
+                "grouped stats",
+                cells=query.n_obs + target.n_obs,
+                genes=query.n_vars + target.n_vars,
+            ):
+                query_stats = _batch_stats(
+                    query, query_clustering, cache, layer, transform
+                )
+                target_stats = _batch_stats(
+                    target, target_clustering, cache, layer, transform
+                )
+        # jobs are prepared while the workers render the previous ones, and only a few of them
+        # are held at any time
+        with _headless() if n_jobs == 1 else nullcontext():
+            for records in util._map(
+                _render_dotplot,
+                jobs(profiler),
+                n_jobs,
+                executor=ProcessPoolExecutor,
+                initializer=mpl.use,
+                initargs=("agg",),
+            ):
+                # the workers cannot reach the callback, so their records are passed on here
+                if profiler is not None:
+                    for record in records:
+                        profiler.add(record)
+    if profile is True:
+        return pairs, profiler.to_frame()
+    return pairs
@@ -3,26 +3,30 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/00_util.ipynb.
 
 # %% auto #0
-__all__ = ['procrustes', 'grouped_obs_mean', 'grouped_obs_present', 'grouped_obs_percent', 'rescale', 'find_center',
-           'map_fine_to_coarse', 'collapse_unrelated_clusters']
+__all__ = ['grouped_stats_cache', 'procrustes', 'grouped_obs_mean', 'grouped_obs_present', 'grouped_obs_percent',
+           'grouped_obs_stats', 'GroupedStats', 'grouped_stats', 'batch_grouped_stats', 'GroupedStatsCache', 'rescale',
+           'find_center', 'find_centers', 'resolve_palette', 'map_fine_to_coarse', 'collapse_unrelated_clusters',
+           'batch_collapse_unrelated_clusters', 'Profiler', 'profile_stage', 'profiling']
 
 # %% ../nbs/00_util.ipynb #e9745558
+import contextvars
+import hashlib
 import os
-import pickle
-from pathlib import Path
-from typing import Union
-from urllib.error import HTTPError
-from urllib.request import urlopen
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Tuple, Union
 
 import anndata as ad
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import requests
-import scanpy as sc
+from matplotlib.colors import is_color_like, to_hex
 from matplotlib.patches import Patch
-from scipy.stats import gaussian_kde
-from tqdm.auto import tqdm
+from scipy import sparse
 
 # %% ../nbs/00_util.ipynb #c7e03cc2
 def procrustes(
@@ -45,32 +49,297 @@ def procrustes(
             print("Invalid side argument; returning string as-is.")
     return x
 
+# %% ../nbs/00_util.ipynb #0ee6cfed
+# number of cells reduced at once from in-memory matrices, and read at once from backed ones
+_CHUNK_SIZE = 100_000
+_BACKED_CHUNK_SIZE = 10_000
+# transforms that may be applied to the stored values of a matrix: they keep zeros at zero
+_TRANSFORMS = {"expm1": np.expm1}
+
+
+def _group_codes(
+    adata: ad.AnnData,  # AnnData object to analyse
+    group_key: str,  # `.obs` category to group by
+) -> Tuple[
+    np.ndarray, pd.Index
+]:  # group code of every cell (-1 if missing) and the group names
+    "Encode an `.obs` column as integer codes, listing the groups in the same order as `groupby`."
+    groups = adata.obs[group_key]
+    if not isinstance(groups, pd.Series):
+        # lazily loaded (e.g. zarr) annotations
+        groups = groups.to_pandas()
+    if not isinstance(groups.dtype, pd.CategoricalDtype):
+        groups = groups.astype("category")
+    return groups.cat.codes.to_numpy(), groups.cat.categories
+
+
+def _select_genes(
+    adata: ad.AnnData,  # AnnData object the matrix belongs to
+    genes: Union[
+        List[str], np.ndarray, None
+    ] = None,  # genes to keep. If none, keep all genes
+) -> Tuple[
+    Union[np.ndarray, None], pd.Index
+]:  # column indices to reduce (None for all) and their names
+    "Find the matrix columns of the requested genes, so that unused columns are never touched."
+    if genes is None:
+        return None, adata.var_names
+    idx = adata.var_names.get_indexer(genes)
+    if np.any(idx < 0):
+        raise KeyError(f"{list(np.asarray(genes)[idx < 0])} not in index")
+    return idx, adata.var_names[idx]
+
+
+def _in_memory(X) -> bool:
+    "Whether `X` is an in-memory matrix, as opposed to a backed HDF5/zarr dataset."
+    return isinstance(X, np.ndarray) or sparse.issparse(X)
+
+
+def _group_indicator(
+    codes: np.ndarray,  # group code of every cell, or one row of codes per clustering; cells with a negative code are ignored
+    no_groups: int,  # number of groups
+) -> sparse.csr_matrix:  # a sparse groups$\times$cells one-hot matrix
+    "One-hot encode group codes so that grouped sums become a single matrix product."
+    codes = np.atleast_2d(codes)
+    clusterings, cells = np.nonzero(codes >= 0)
+    return sparse.csr_matrix(
+        (np.ones(len(cells), dtype=np.float64), (codes[clusterings, cells], cells)),
+        shape=(no_groups, codes.shape[1]),
+    )
+
+
+def _check_transform(
+    transform: Union[str, None],  # name of a transform, or None
+) -> None:
+    "Make sure that a transform can be applied to the stored values of a matrix."
+    if transform is not None and transform not in _TRANSFORMS:
+        raise ValueError(
+            f"unknown transform {transform!r}; choose one of {list(_TRANSFORMS)}"
+        )
+
+
+def _transformed(
+    X,  # cells$\times$genes expression matrix, dense or sparse
+    transform: Union[str, None],  # name of a transform, or None
+):  # `X` with the transform applied to its values
+    "Transform the stored values of a block; sparse blocks keep their structure and indices."
+    if transform is None:
+        return X
+    func = _TRANSFORMS[transform]
+    if sparse.issparse(X):
+        return type(X)((func(X.data), X.indices, X.indptr), shape=X.shape)
+    return func(X)
+
+
+def _reduce_block(
+    X,  # cells$\times$genes expression matrix, dense or sparse
+    indicator: sparse.csr_matrix,  # groups$\times$cells one-hot matrix
+    sums: bool = True,  # whether to calculate the per-group sums
+    present: bool = True,  # whether to calculate the per-group number of expressing cells
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before they are summed, e.g. "expm1"
+) -> Tuple[
+    Union[np.ndarray, None], Union[np.ndarray, None]
+]:  # groups$\times$genes arrays
+    "Sum expression and count expressing cells per group in one pass over `X`."
+    if sparse.issparse(X) and X.format not in ("csr", "csc"):
+        X = X.tocsr()
+
+    group_sums = None
+    group_present = None
+    if sums:
+        group_sums = indicator @ _transformed(X, transform)
+    if present:
+        if sparse.issparse(X):
+            # reuse the sparsity structure of X; only the stored values are binarised
+            expressed = type(X)((X.data > 0, X.indices, X.indptr), shape=X.shape)
+        else:
+            expressed = X > 0
+        group_present = indicator @ expressed
+
+    if sparse.issparse(group_sums):
+        group_sums = group_sums.toarray()
+    if sparse.issparse(group_present):
+        group_present = group_present.toarray()
+    return group_sums, group_present
+
+
+def _row_block(
+    X,  # cells$\times$genes expression matrix; in memory, or a backed HDF5/zarr dataset
+    start: int,  # first row of the block
+    stop: int,  # row after the last row of the block
+):  # the rows `start:stop` of `X`, in memory
+    "Get a block of rows of `X`; in-memory CSR and dense matrices are sliced without copying."
+    if sparse.issparse(X) and X.format == "csr":
+        lo, hi = X.indptr[start], X.indptr[stop]
+        return type(X)(
+            (X.data[lo:hi], X.indices[lo:hi], X.indptr[start : stop + 1] - lo),
+            shape=(stop - start, X.shape[1]),
+        )
+    block = X[start:stop]
+    if hasattr(block, "compute"):
+        block = block.compute()
+    return block
+
+
+def _map(
+    func: Callable,  # function to apply
+    items: Iterable,  # items to apply it to
+    n_jobs: int = 1,  # number of workers to use; -1 uses all cores
+    executor: type = ThreadPoolExecutor,  # pool class of the workers, e.g. `ProcessPoolExecutor`
+    **kwargs: Any,  # additional arguments of the pool, e.g. an `initializer`
+) -> Iterator:  # the results, in the order of `items`
+    """
+    Apply `func` to `items` lazily in this thread, or in a pool of workers if `n_jobs` is not 1.
+    The pool works on at most `n_jobs` items ahead of the consumer, so only a few items and results
+    are held in memory at any time.
+    """
+    if n_jobs == 1:
+        yield from map(func, items)
+        return
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    items = iter(items)
+    with executor(max_workers=n_jobs, **kwargs) as pool:
+        pending = deque(pool.submit(func, item) for item in islice(items, n_jobs))
+        while pending:
+            result = pending.popleft().result()
+            # keep the pool busy while the consumer handles this result
+            pending.extend(pool.submit(func, item) for item in islice(items, 1))
+            yield result
+
+
+def _grouped_reduce(
+    X,  # cells$\times$genes expression matrix; in memory, or a backed HDF5/zarr dataset
+    codes: np.ndarray,  # group code of every cell, or one row of codes per clustering; cells with a negative code are ignored
+    no_groups: int,  # number of groups
+    genes_idx: Union[
+        np.ndarray, None
+    ] = None,  # columns to reduce. If none, reduce all columns
+    sums: bool = True,  # whether to calculate the per-group sums
+    present: bool = True,  # whether to calculate the per-group number of expressing cells
+    chunk_size: Union[
+        int, None
+    ] = None,  # number of cells per block. If none, use 100000 cells for in-memory and 10000 cells for backed matrices
+    n_jobs: int = 1,  # number of threads that reduce blocks in parallel; -1 uses all cores
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before they are summed, e.g. "expm1"
+) -> Tuple[
+    Union[np.ndarray, None], Union[np.ndarray, None]
+]:  # groups$\times$genes arrays
+    """
+    Accumulate grouped sums and expressing-cell counts over blocks of `X`. The blocks only depend on
+    `chunk_size`, and partial results are added up in block order, so the result does not depend on
+    `n_jobs`. A transform is applied to one block at a time, and only to the stored values of
+    sparse blocks.
+    """
+    _check_transform(transform)
+    no_cells = X.shape[0]
+    in_memory = _in_memory(X)
+    if chunk_size is None:
+        chunk_size = _CHUNK_SIZE if in_memory else _BACKED_CHUNK_SIZE
+    chunk_size = max(chunk_size, 1)
+    if sparse.issparse(X) and X.format not in ("csr", "csc"):
+        X = X.tocsr()
+
+    if sparse.issparse(X) and X.format == "csc":
+        # slicing rows of a CSC matrix is expensive; split it into blocks of genes instead
+        if genes_idx is not None:
+            X = X[:, genes_idx]
+        indicator = _group_indicator(codes, no_groups)
+        no_genes = X.shape[1]
+        starts = range(0, no_genes, chunk_size)
+
+        def reduce_genes(start):
+            stop = min(start + chunk_size, no_genes)
+            return _reduce_block(X[:, start:stop], indicator, sums, present, transform)
+
+        group_sums = np.zeros((no_groups, no_genes)) if sums else None
+        group_present = np.zeros((no_groups, no_genes)) if present else None
+        for start, (block_sums, block_present) in zip(
+            starts, _map(reduce_genes, starts, n_jobs)
+        ):
+            stop = min(start + chunk_size, no_genes)
+            if sums:
+                group_sums[:, start:stop] = block_sums
+            if present:
+                group_present[:, start:stop] = block_present
+        return group_sums, group_present
+
+    def reduce_rows(start):
+        # only this block is ever read into memory
+        stop = min(start + chunk_size, no_cells)
+        block = _row_block(X, start, stop)
+        if genes_idx is not None:
+            block = block[:, genes_idx]
+        indicator = _group_indicator(codes[..., start:stop], no_groups)
+        return _reduce_block(block, indicator, sums, present, transform)
+
+    no_genes = X.shape[1] if genes_idx is None else len(genes_idx)
+    group_sums = np.zeros((no_groups, no_genes)) if sums else None
+    group_present = np.zeros((no_groups, no_genes)) if present else None
+    for block_sums, block_present in _map(
+        reduce_rows, range(0, no_cells, chunk_size), n_jobs
+    ):
+        if sums:
+            group_sums += block_sums
+        if present:
+            group_present += block_present
+    return group_sums, group_present
+
 # %% ../nbs/00_util.ipynb #9b33fb36
 def grouped_obs_mean(
     adata: ad.AnnData,  # AnnData object to analyse
     group_key: str,  # `.obs` category to group by
     layer: Union[str, None] = None,  # layer to use. If none, use `.X`
+    genes: Union[
+        List[str], np.ndarray, None
+    ] = None,  # genes to calculate the average for. If none, use all genes
+    chunk_size: Union[
+        int, None
+    ] = None,  # number of cells to reduce at once (default: 100000, or 10000 for backed matrices). Backed (`backed="r"`) and zarr matrices are streamed in chunks of this size, so peak memory does not grow with the dataset
+    n_jobs: int = 1,  # number of threads that reduce blocks of the matrix in parallel; -1 uses all cores. The result does not depend on it
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before averaging. "expm1" averages log1p-normalised data in linear space; it is applied to the stored values of each block, so no extra layer or dense copy is created
+    relog: bool = False,  # whether to log1p-transform the averages again, e.g. after `transform="expm1"`
 ) -> pd.DataFrame:  # a groups$\times$genes dataframe with the average expression
     "Helper function to calculate average expression per group in an `AnnData` object."
-    if layer is not None:
-        getX = lambda x: x.layers[layer]
-    else:
-        getX = lambda x: x.X
-
-    grouped = adata.obs.groupby(group_key, observed=False)
-    out = pd.DataFrame(
-        np.zeros((adata.shape[1], len(grouped)), dtype=np.float64),
-        columns=list(grouped.groups.keys()),
-        index=adata.var_names,
+    X = adata.X if layer is None else adata.layers[layer]
+    genes_idx, var_names = _select_genes(adata, genes)
+    codes, groups = _group_codes(adata, group_key)
+    group_sums, _ = _grouped_reduce(
+        X,
+        codes,
+        len(groups),
+        genes_idx,
+        present=False,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+        transform=transform,
+    )
+    cluster_size = np.bincount(codes[codes >= 0], minlength=len(groups))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_mean = group_sums / cluster_size[:, None]
+    if relog:
+        group_mean = np.log1p(group_mean)
+    return pd.DataFrame(
+        np.asarray(group_mean, dtype=np.float64).T,
+        index=var_names,
+        columns=list(groups),
     )
-
-    for group, idx in grouped.indices.items():
-        X = getX(adata[idx])
-        out[group] = np.ravel(X.mean(axis=0, dtype=np.float64))
-    return out
 
 # %% ../nbs/00_util.ipynb #54597aab
-def grouped_obs_present(adata, group_key, layer: Union[str, None] = None):
+def grouped_obs_present(
+    adata,
+    group_key,
+    layer: Union[str, None] = None,
+    genes: Union[List[str], np.ndarray, None] = None,
+    chunk_size: Union[int, None] = None,
+    n_jobs: int = 1,
+):
     """
     Helper function to calculate how many cells express each gene per group in an `AnnData` object.
 
@@ -82,31 +351,50 @@ def grouped_obs_present(adata, group_key, layer: Union[str, None] = None):
         `.obs` category to group by.
     layer : Union[str, None], optional
         Layer to use. If none, use `.X`.
+    genes : Union[List[str], np.ndarray, None], optional
+        Genes to count expressing cells for. Only these columns of the matrix are reduced. If none,
+        use all genes.
+    chunk_size : Union[int, None], optional
+        Number of cells to reduce at once. Backed (`backed="r"`) and zarr matrices are streamed in
+        chunks of this size, so peak memory does not grow with the dataset (default: 100000, or
+        10000 for backed matrices).
+
+    n_jobs : int, optional
+        Number of threads that reduce blocks of the matrix in parallel; -1 uses all cores. The
+        result does not depend on it (default: 1).
 
     Returns
     -------
     pd.DataFrame
         A clusters$\times$genes dataframe with the number of expressing cells per cluster.
     """
-    if layer is not None:
-        getX = lambda x: x.layers[layer]
-    else:
-        getX = lambda x: x.X
-
-    grouped = adata.obs.groupby(group_key, observed=False)
-    out = pd.DataFrame(
-        np.zeros((adata.shape[1], len(grouped)), dtype=np.float64),
-        columns=list(grouped.groups.keys()),
-        index=adata.var_names,
+    X = adata.X if layer is None else adata.layers[layer]
+    genes_idx, var_names = _select_genes(adata, genes)
+    codes, groups = _group_codes(adata, group_key)
+    _, group_present = _grouped_reduce(
+        X,
+        codes,
+        len(groups),
+        genes_idx,
+        sums=False,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+    return pd.DataFrame(
+        np.asarray(group_present, dtype=np.float64).T,
+        index=var_names,
+        columns=list(groups),
     )
-
-    for group, idx in grouped.indices.items():
-        X = getX(adata[idx])
-        out[group] = np.ravel((X > 0).sum(axis=0, dtype=np.float64))
-    return out
 
 # %% ../nbs/00_util.ipynb #150fc6fc
-def grouped_obs_percent(adata, group_key, layer: Union[str, None] = None):
+def grouped_obs_percent(
+    adata,
+    group_key,
+    layer: Union[str, None] = None,
+    genes: Union[List[str], np.ndarray, None] = None,
+    chunk_size: Union[int, None] = None,
+    n_jobs: int = 1,
+):
     """
     Helper function to calculate what percentage of cells express each gene per group in an
     `AnnData` object.
@@ -119,16 +407,743 @@ def grouped_obs_percent(adata, group_key, layer: Union[str, None] = None):
         `.obs` category to group by.
     layer : str, optional
         Layer to use. If none, use `.X`.
+    genes : Union[List[str], np.ndarray, None], optional
+        Genes to calculate the percentage for. Only these columns of the matrix are reduced. If
+        none, use all genes.
+    chunk_size : Union[int, None], optional
+        Number of cells to reduce at once. Backed (`backed="r"`) and zarr matrices are streamed in
+        chunks of this size, so peak memory does not grow with the dataset (default: 100000, or
+        10000 for backed matrices).
+
+    n_jobs : int, optional
+        Number of threads that reduce blocks of the matrix in parallel; -1 uses all cores. The
+        result does not depend on it (default: 1).
 
     Returns
     -------
     pd.DataFrame
         A clusters$\times$genes dataframe with the percentage of expressing cells per cluster.
     """
-    num_expressing = grouped_obs_present(adata, group_key, layer=layer)
-    no_cells_per_cluster = adata.obs[group_key].value_counts()
+    num_expressing = grouped_obs_present(
+        adata,
+        group_key,
+        layer=layer,
+        genes=genes,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+    )
+    codes, groups = _group_codes(adata, group_key)
+    no_cells_per_cluster = pd.Series(
+        np.bincount(codes[codes >= 0], minlength=len(groups)), index=groups
+    )
     return num_expressing / no_cells_per_cluster
 
+# %% ../nbs/00_util.ipynb #bacc16dc
+def grouped_obs_stats(
+    adata: ad.AnnData,  # AnnData object to analyse
+    group_key: str,  # `.obs` category to group by
+    layer: Union[str, None] = None,  # layer to use. If none, use `.X`
+    genes: Union[
+        List[str], np.ndarray, None
+    ] = None,  # genes to calculate the statistics for. If none, use all genes
+    chunk_size: Union[
+        int, None
+    ] = None,  # number of cells to reduce at once (default: 100000, or 10000 for backed matrices). Backed (`backed="r"`) and zarr matrices are streamed in chunks of this size, so peak memory does not grow with the dataset
+    n_jobs: int = 1,  # number of threads that reduce blocks of the matrix in parallel; -1 uses all cores. The result does not depend on it
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before they are summed and averaged, e.g. "expm1"; see `grouped_obs_mean`
+) -> Tuple[
+    pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame
+]:  # genes$\times$groups dataframes with the summed expression, the number of expressing cells, the average expression and the fraction of expressing cells
+    "Calculate sums, expressing cells, means and fractions per group in a single pass over the matrix."
+    X = adata.X if layer is None else adata.layers[layer]
+    genes_idx, var_names = _select_genes(adata, genes)
+    codes, groups = _group_codes(adata, group_key)
+    group_sums, group_present = _grouped_reduce(
+        X,
+        codes,
+        len(groups),
+        genes_idx,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+        transform=transform,
+    )
+    cluster_size = np.bincount(codes[codes >= 0], minlength=len(groups))
+
+    # empty groups have an undefined mean/fraction, just like the mean of an empty slice
+    with np.errstate(divide="ignore", invalid="ignore"):
+        group_mean = group_sums / cluster_size[:, None]
+        group_percent = group_present / cluster_size[:, None]
+
+    tables = [
+        pd.DataFrame(
+            np.asarray(x, dtype=np.float64).T,
+            index=var_names,
+            columns=list(groups),
+        )
+        for x in (group_sums, group_present, group_mean, group_percent)
+    ]
+    return tuple(tables)
+
+# %% ../nbs/00_util.ipynb #b43f52dd
+class GroupedStats:
+    """
+    Compact per-group statistics of a set of genes.
+
+    Parameters
+    ----------
+    sums : Union[np.ndarray, None]
+        genes$\\times$groups summed expression; None if it was not calculated.
+    present : Union[np.ndarray, None]
+        genes$\\times$groups number of expressing cells; None if it was not calculated.
+    cluster_size : np.ndarray
+        Number of cells in every group.
+    var_names : pd.Index
+        Names of all genes of the dataset; shared, not copied.
+    groups : pd.Index
+        Names of the groups.
+    gene_codes : Union[np.ndarray, None], optional
+        Position of every row in `var_names`. If None, the rows are all genes (default: None).
+    """
+
+    __slots__ = (
+        "sums",
+        "present",
+        "cluster_size",
+        "var_names",
+        "groups",
+        "_codes",
+        "_mean",
+        "_percent",
+    )
+
+    def __init__(
+        self,
+        sums: Union[np.ndarray, None],
+        present: Union[np.ndarray, None],
+        cluster_size: np.ndarray,
+        var_names: pd.Index,
+        groups: pd.Index,
+        gene_codes: Union[np.ndarray, None] = None,
+    ):
+        self.sums = None if sums is None else np.ascontiguousarray(sums, np.float32)
+        self.present = (
+            None if present is None else np.ascontiguousarray(present, np.float32)
+        )
+        self.cluster_size = np.asarray(cluster_size, dtype=np.int64)
+        self.var_names = var_names
+        self.groups = pd.Index(groups)
+        self._codes = None if gene_codes is None else np.asarray(gene_codes, np.int64)
+        self._mean = None
+        self._percent = None
+
+    def __len__(self) -> int:
+        return len(self.var_names) if self._codes is None else len(self._codes)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        "Number of genes and groups."
+        return len(self), len(self.groups)
+
+    @property
+    def nbytes(self) -> int:
+        "Memory taken up by the tables, in bytes."
+        tables = (self.sums, self.present, self._mean, self._percent)
+        return sum(x.nbytes for x in tables if x is not None)
+
+    @property
+    def gene_codes(self) -> np.ndarray:
+        "Position of every row in `var_names`."
+        if self._codes is None:
+            return np.arange(len(self.var_names))
+        return self._codes
+
+    @property
+    def genes(self) -> pd.Index:
+        "Names of the genes, in the order of the rows."
+        return self.var_names if self._codes is None else self.var_names[self._codes]
+
+    def _per_cell(self, statistic: str) -> np.ndarray:
+        values = getattr(self, statistic)
+        if values is None:
+            raise ValueError(f"the {statistic} were not calculated")
+        # empty groups have an undefined mean/fraction, just like the mean of an empty slice
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return values / self.cluster_size.astype(np.float32)
+
+    @property
+    def mean(self) -> np.ndarray:
+        "genes$\\times$groups average expression."
+        if self._mean is None:
+            self._mean = self._per_cell("sums")
+        return self._mean
+
+    @property
+    def percent(self) -> np.ndarray:
+        "genes$\\times$groups fraction of expressing cells."
+        if self._percent is None:
+            self._percent = self._per_cell("present")
+        return self._percent
+
+    def subset(self, genes: Union[List[str], np.ndarray]) -> "GroupedStats":
+        """
+        Select genes by name.
+
+        Parameters
+        ----------
+        genes : Union[List[str], np.ndarray]
+            Genes to keep, in the order they should appear in.
+
+        Returns
+        -------
+        GroupedStats
+            The statistics of the selected genes, sharing `var_names` and the group sizes.
+        """
+        rows = self.genes.get_indexer(genes)
+        if np.any(rows < 0):
+            raise KeyError(f"{list(np.asarray(genes)[rows < 0])} not in index")
+        return GroupedStats(
+            None if self.sums is None else self.sums[rows],
+            None if self.present is None else self.present[rows],
+            self.cluster_size,
+            self.var_names,
+            self.groups,
+            self.gene_codes[rows],
+        )
+
+    def roll_up(
+        self,
+        mapping: Union[Mapping, pd.Series, pd.DataFrame],
+        species: Union[str, None] = None,
+    ) -> "GroupedStats":
+        """
+        Add up the statistics of fine groups to those of the coarse groups they belong to, without
+        going back to the cells. Sums, expressing-cell counts and group sizes are additive, so this
+        costs groups$\\times$genes instead of cells$\\times$genes.
+
+        Parameters
+        ----------
+        mapping : Union[Mapping, pd.Series, pd.DataFrame]
+            Coarse group of every fine group: a mapping or series indexed by the fine groups, or a
+            dataframe with the fine groups in the first and the coarse groups in the second column,
+            such as the one returned by `map_fine_to_coarse`. Fine groups without cells may be
+            left out.
+        species : Union[str, None], optional
+            Species ID that prepends the fine groups in `mapping`, as in the output of
+            `map_fine_to_coarse`. It is removed before the groups are matched, as is the coarse
+            group that `map_fine_to_coarse(..., include_coarse=True)` adds after it (default: None).
+
+        Returns
+        -------
+        GroupedStats
+            The statistics of the same genes for the coarse groups, which are ordered like the
+            categories of a categorical mapping, or else by their first appearance.
+        """
+        if isinstance(mapping, pd.DataFrame):
+            mapping = pd.Series(
+                mapping.iloc[:, 1].array, index=mapping.iloc[:, 0].to_numpy()
+            )
+        elif not isinstance(mapping, pd.Series):
+            mapping = pd.Series(mapping)
+        fine = self.groups
+        labels = mapping.index
+        if species is not None:
+            prefix = f"{species}_"
+            fine = fine.astype(str)
+            labels = [
+                x[len(prefix) :] if x.startswith(prefix) else x
+                for x in labels.astype(str)
+            ]
+            # labels of `include_coarse` mappings read `{species}_{coarse}_{fine}`
+            labels = pd.Index(
+                [
+                    x[len(f"{c}_") :] if x not in fine and x.startswith(f"{c}_") else x
+                    for x, c in zip(labels, mapping.astype(str))
+                ]
+            )
+        pairs = pd.DataFrame({"fine": labels, "coarse": mapping.to_numpy()})
+        pairs = pairs.drop_duplicates()
+        if pairs["fine"].duplicated().any():
+            split = list(pairs.loc[pairs["fine"].duplicated(), "fine"].unique())
+            raise ValueError(f"{split} belong to more than one coarse group")
+
+        if isinstance(mapping.dtype, pd.CategoricalDtype):
+            coarse = mapping.cat.categories
+            codes = pd.Categorical(pairs["coarse"], categories=coarse).codes
+        else:
+            codes, coarse = pd.factorize(pairs["coarse"])
+        rows = fine.get_indexer(pairs["fine"])
+        if np.any(rows < 0):
+            raise KeyError(f"{list(pairs['fine'][rows < 0])} not in groups")
+        coarse_codes = np.full(len(fine), -1, dtype=np.int64)
+        coarse_codes[rows] = codes
+        unmapped = (coarse_codes < 0) & (self.cluster_size > 0)
+        if np.any(unmapped):
+            raise KeyError(f"{list(fine[unmapped])} have no coarse group")
+
+        # coarse$\times$fine one-hot matrix; products with it add up the fine groups
+        indicator = _group_indicator(coarse_codes, len(coarse))
+        return GroupedStats(
+            None if self.sums is None else (indicator @ self.sums.T).T,
+            None if self.present is None else (indicator @ self.present.T).T,
+            indicator @ self.cluster_size,
+            self.var_names,
+            pd.Index(coarse),
+            self._codes,
+        )
+
+    def to_frame(
+        self, statistic: str = "mean", transpose: bool = False
+    ) -> pd.DataFrame:
+        """
+        View one of the statistics as a dataframe, without copying it.
+
+        Parameters
+        ----------
+        statistic : str, optional
+            One of "sums", "present", "mean" or "percent" (default: "mean").
+        transpose : bool, optional
+            Whether to return a groups$\\times$genes instead of a genes$\\times$groups dataframe
+            (default: False).
+
+        Returns
+        -------
+        pd.DataFrame
+            The statistic, labelled with the gene and group names.
+        """
+        if statistic not in ("sums", "present", "mean", "percent"):
+            raise ValueError(f"unknown statistic {statistic!r}")
+        values = getattr(self, statistic)
+        if values is None:
+            raise ValueError(f"the {statistic} were not calculated")
+        if transpose:
+            return pd.DataFrame(
+                values.T, index=list(self.groups), columns=self.genes, copy=False
+            )
+        return pd.DataFrame(
+            values, index=self.genes, columns=list(self.groups), copy=False
+        )
+
+
+def grouped_stats(
+    adata: ad.AnnData,  # AnnData object to analyse
+    group_key: str,  # `.obs` category to group by
+    layer: Union[str, None] = None,  # layer to use. If none, use `.X`
+    genes: Union[
+        List[str], np.ndarray, None
+    ] = None,  # genes to calculate the statistics for. If none, use all genes
+    sums: bool = True,  # whether to calculate the per-group sums (and means)
+    present: bool = True,  # whether to count the expressing cells per group
+    chunk_size: Union[
+        int, None
+    ] = None,  # number of cells to reduce at once (default: 100000, or 10000 for backed matrices)
+    n_jobs: int = 1,  # number of threads that reduce blocks of the matrix in parallel; -1 uses all cores
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before they are summed, e.g. "expm1"; see `grouped_obs_mean`
+) -> GroupedStats:  # the compact statistics of the requested genes
+    "Calculate grouped statistics in a single pass over the matrix, as a compact `GroupedStats`."
+    X = adata.X if layer is None else adata.layers[layer]
+    genes_idx, _ = _select_genes(adata, genes)
+    codes, groups = _group_codes(adata, group_key)
+    group_sums, group_present = _grouped_reduce(
+        X,
+        codes,
+        len(groups),
+        genes_idx,
+        sums=sums,
+        present=present,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+        transform=transform,
+    )
+    return GroupedStats(
+        None if group_sums is None else np.asarray(group_sums).T,
+        None if group_present is None else np.asarray(group_present).T,
+        np.bincount(codes[codes >= 0], minlength=len(groups)),
+        adata.var_names,
+        groups,
+        genes_idx,
+    )
+
+
+def _take_groups(
+    values: np.ndarray,  # groups$\times$genes statistics
+    rows: Union[
+        slice, sparse.csr_matrix
+    ],  # rows to take, or a one-hot matrix that adds them up
+) -> np.ndarray:  # the selected or summed rows
+    "Select the groups of one clustering from stacked statistics, or add them up from joint groups."
+    if isinstance(rows, slice):
+        return values[rows]
+    return np.asarray(rows @ values)
+
+
+def batch_grouped_stats(
+    adata: ad.AnnData,  # AnnData object to analyse
+    group_keys: Iterable[str],  # `.obs` categories to group by
+    layer: Union[str, None] = None,  # layer to use. If none, use `.X`
+    genes: Union[
+        List[str], np.ndarray, None
+    ] = None,  # genes to calculate the statistics for. If none, use all genes
+    sums: bool = True,  # whether to calculate the per-group sums (and means)
+    present: bool = True,  # whether to count the expressing cells per group
+    chunk_size: Union[
+        int, None
+    ] = None,  # number of cells to reduce at once (default: 100000, or 10000 for backed matrices)
+    n_jobs: int = 1,  # number of threads that reduce blocks of the matrix in parallel; -1 uses all cores
+    transform: Union[
+        str, None
+    ] = None,  # transform of the values before they are summed, e.g. "expm1"; see `grouped_obs_mean`
+) -> Dict[str, GroupedStats]:  # the compact statistics of every clustering
+    "Calculate the grouped statistics of several clusterings in a single pass over the matrix."
+    X = adata.X if layer is None else adata.layers[layer]
+    genes_idx, _ = _select_genes(adata, genes)
+    group_keys = list(dict.fromkeys(group_keys))
+    if len(group_keys) == 0:
+        raise ValueError("group_keys must not be empty")
+    encoded = [_group_codes(adata, key) for key in group_keys]
+    offsets = np.cumsum([0] + [len(groups) for _, groups in encoded])
+
+    # cells that share their groups in all clusterings are reduced together; the statistics of
+    # every clustering are then added up from these joint groups
+    joint = np.zeros(adata.n_obs, dtype=np.int64)
+    for c, groups in encoded:
+        joint = joint * (len(groups) + 1) + c.astype(np.int64) + 1
+        _, first, joint = np.unique(joint, return_index=True, return_inverse=True)
+        joint = joint.reshape(-1)
+    if len(first) <= offsets[-1]:
+        codes, no_groups = joint, len(first)
+    else:
+        # clusterings that cut across each other have more joint groups than groups; reduce a
+        # stacked indicator of all clusterings instead, which still reads every block only once
+        codes = np.stack(
+            [
+                np.where(c >= 0, c.astype(np.int64) + offset, -1)
+                for (c, _), offset in zip(encoded, offsets)
+            ]
+        )
+        no_groups = offsets[-1]
+    group_sums, group_present = _grouped_reduce(
+        X,
+        codes,
+        no_groups,
+        genes_idx,
+        sums=sums,
+        present=present,
+        chunk_size=chunk_size,
+        n_jobs=n_jobs,
+        transform=transform,
+    )
+
+    stats = {}
+    for key, (c, groups), start, stop in zip(
+        group_keys, encoded, offsets[:-1], offsets[1:]
+    ):
+        if codes.ndim == 1:
+            rows = _group_indicator(c[first].astype(np.int64), len(groups))
+        else:
+            rows = slice(start, stop)
+        stats[key] = GroupedStats(
+            None if group_sums is None else _take_groups(group_sums, rows).T,
+            None if group_present is None else _take_groups(group_present, rows).T,
+            np.bincount(c[c >= 0], minlength=len(groups)),
+            adata.var_names,
+            groups,
+            genes_idx,
+        )
+    return stats
+
+# %% ../nbs/00_util.ipynb #446406e1
+def _hash_array(
+    digest,  # hashlib object to update
+    values: np.ndarray,  # array to hash
+    rows: int = 65536,  # number of rows to copy at once if the array is not contiguous
+) -> None:
+    "Feed an array to a hash without copying it, or in blocks of rows if it is not contiguous."
+    values = np.asarray(values)
+    digest.update(repr((values.shape, str(values.dtype))).encode())
+    if values.flags.c_contiguous:
+        digest.update(values.reshape(-1).view(np.uint8))
+        return
+    for start in range(0, len(values), rows):
+        digest.update(np.ascontiguousarray(values[start : start + rows]).view(np.uint8))
+
+
+def _hash_sample(
+    digest,  # hashlib object to update
+    values: np.ndarray,  # array to hash
+    size: int = 4096,  # number of values to hash
+) -> None:
+    "Feed the shape and dtype of an array and a fixed sample of evenly spaced values to a hash."
+    values = np.asarray(values)
+    digest.update(repr((values.shape, str(values.dtype))).encode())
+    if values.size > 0:
+        positions = np.linspace(0, values.size - 1, num=min(size, values.size))
+        _hash_array(digest, values.flat[positions.astype(np.int64)])
+
+
+def _hash_matrix(
+    digest,  # hashlib object to update
+    X,  # in-memory matrix, dense or sparse
+    sample: bool = False,  # whether to hash only a fixed sample of every array; see `_hash_sample`
+) -> None:
+    "Feed the stored values and, for sparse matrices, the structure of a matrix to a hash."
+    hash_array = _hash_sample if sample else _hash_array
+    if not sparse.issparse(X):
+        hash_array(digest, X)
+        return
+    for part in ("data", "indices", "indptr", "row", "col", "offsets"):
+        if hasattr(X, part):
+            hash_array(digest, getattr(X, part))
+
+
+def _fingerprint(
+    X,  # cells$\times$genes expression matrix, dense or sparse
+    codes: np.ndarray,  # group code of every cell
+    groups: pd.Index,  # group names
+) -> str:  # hexadecimal digest
+    """
+    Fingerprint a matrix and a clustering. In-memory matrices are identified by their shape, dtype,
+    number of stored values and a fixed sample of their arrays, so that a lookup costs next to
+    nothing; edits that keep the structure and miss the sample are not detected. Backed HDF5
+    matrices are opened read-only and are identified by their file, its size and its modification
+    time; dask arrays by their name. The clustering is hashed in full.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((type(X).__name__, X.shape, str(X.dtype))).encode())
+    if not _in_memory(X):
+        source = getattr(X, "group", X)
+        filename = getattr(getattr(source, "file", None), "filename", None)
+        if filename is not None and os.path.exists(filename):
+            status = os.stat(filename)
+            digest.update(repr((filename, status.st_size, status.st_mtime_ns)).encode())
+        elif hasattr(X, "dask"):
+            # dask names are tokens of the data source and the operations on it
+            digest.update(X.name.encode())
+        else:
+            for start in range(0, X.shape[0], _BACKED_CHUNK_SIZE):
+                stop = min(start + _BACKED_CHUNK_SIZE, X.shape[0])
+                _hash_matrix(digest, _row_block(X, start, stop))
+    else:
+        _hash_matrix(digest, X, sample=True)
+    _hash_array(digest, codes)
+    digest.update(repr(list(groups)).encode())
+    return digest.hexdigest()
+
+
+class GroupedStatsCache:
+    """
+    Least-recently-used cache of per-group sums and expressing-cell counts.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Upper bound for the memory taken up by the cached tables, in bytes. Once it is exceeded,
+        the least recently used entries are evicted (default: 1 GiB).
+    chunk_size : Union[int, None], optional
+        Number of cells to reduce at once; see `grouped_obs_mean` (default: None).
+    n_jobs : int, optional
+        Number of threads that reduce blocks of the matrix in parallel (default: 1).
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 2**30,
+        chunk_size: Union[int, None] = None,
+        n_jobs: int = 1,
+    ):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        "Drop all cached tables."
+        self._entries.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+    def get(
+        self,
+        adata: ad.AnnData,
+        group_key: str,
+        layer: Union[str, None] = None,
+        transform: Union[str, None] = None,
+    ) -> GroupedStats:
+        """
+        Get the grouped statistics of an `AnnData` object, calculating them if they are not cached.
+
+        Parameters
+        ----------
+        adata : ad.AnnData
+            AnnData object to analyse.
+        group_key : str
+            `.obs` category to group by.
+        layer : Union[str, None], optional
+            Layer to use. If none, use `.X`.
+        transform : Union[str, None], optional
+            Transform of the values before they are summed, e.g. "expm1"; see `grouped_obs_mean`.
+            Every transform is cached separately.
+
+        Returns
+        -------
+        GroupedStats
+            The cached statistics of all genes. Do not modify them in place.
+        """
+        X = adata.X if layer is None else adata.layers[layer]
+        codes, groups = _group_codes(adata, group_key)
+        key = (group_key, layer, transform, _fingerprint(X, codes, groups))
+
+        entry = self._lookup(adata, key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        group_sums, group_present = _grouped_reduce(
+            X,
+            codes,
+            len(groups),
+            chunk_size=self.chunk_size,
+            n_jobs=self.n_jobs,
+            transform=transform,
+        )
+        entry = GroupedStats(
+            np.asarray(group_sums).T,
+            np.asarray(group_present).T,
+            np.bincount(codes[codes >= 0], minlength=len(groups)),
+            adata.var_names.copy(),
+            groups,
+        )
+        self._store(key, entry)
+        return entry
+
+    def prefetch(
+        self,
+        adata: ad.AnnData,
+        group_keys: Iterable[str],
+        layer: Union[str, None] = None,
+        transform: Union[str, None] = None,
+    ) -> None:
+        """
+        Calculate the statistics of several clusterings that are not cached yet in a single pass
+        over the matrix, e.g. before plotting dotplots for each of them.
+
+        Parameters
+        ----------
+        adata : ad.AnnData
+            AnnData object to analyse.
+        group_keys : Iterable[str]
+            `.obs` categories to group by.
+        layer : Union[str, None], optional
+            Layer to use. If none, use `.X`.
+        transform : Union[str, None], optional
+            Transform of the values before they are summed, e.g. "expm1"; see `grouped_obs_mean`.
+        """
+        X = adata.X if layer is None else adata.layers[layer]
+        missing = {}
+        for group_key in dict.fromkeys(group_keys):
+            codes, groups = _group_codes(adata, group_key)
+            key = (group_key, layer, transform, _fingerprint(X, codes, groups))
+            if self._lookup(adata, key) is None:
+                missing[group_key] = key
+        if not missing:
+            return
+
+        self.misses += len(missing)
+        stats = batch_grouped_stats(
+            adata,
+            missing,
+            layer=layer,
+            chunk_size=self.chunk_size,
+            n_jobs=self.n_jobs,
+            transform=transform,
+        )
+        var_names = adata.var_names.copy()
+        for group_key, key in missing.items():
+            entry = stats[group_key]
+            self._store(
+                key,
+                GroupedStats(
+                    entry.sums,
+                    entry.present,
+                    entry.cluster_size,
+                    var_names,
+                    entry.groups,
+                ),
+            )
+
+    def _lookup(self, adata: ad.AnnData, key: tuple) -> Union[GroupedStats, None]:
+        entry = self._entries.get(key)
+        if entry is None or not entry.var_names.equals(adata.var_names):
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: tuple, entry: GroupedStats) -> None:
+        size = entry.nbytes
+        if key in self._entries:
+            self.nbytes -= self._sizes.pop(key)
+            del self._entries[key]
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._sizes[key] = size
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            evicted, _ = self._entries.popitem(last=False)
+            self.nbytes -= self._sizes.pop(evicted)
+
+    def stats(
+        self,
+        adata: ad.AnnData,
+        group_key: str,
+        layer: Union[str, None] = None,
+        genes: Union[List[str], np.ndarray, None] = None,
+        transform: Union[str, None] = None,
+    ) -> GroupedStats:
+        "Cached equivalent of `grouped_stats`."
+        entry = self.get(adata, group_key, layer=layer, transform=transform)
+        if genes is not None:
+            return entry.subset(genes)
+        # share the arrays, but keep the derived tables off the cached entry
+        return GroupedStats(
+            entry.sums, entry.present, entry.cluster_size, entry.var_names, entry.groups
+        )
+
+    def mean(
+        self,
+        adata: ad.AnnData,
+        group_key: str,
+        layer: Union[str, None] = None,
+        genes: Union[List[str], np.ndarray, None] = None,
+        transform: Union[str, None] = None,
+    ) -> pd.DataFrame:
+        "Cached equivalent of `grouped_obs_mean`."
+        return self.stats(adata, group_key, layer, genes, transform).to_frame("mean")
+
+    def percent(
+        self,
+        adata: ad.AnnData,
+        group_key: str,
+        layer: Union[str, None] = None,
+        genes: Union[List[str], np.ndarray, None] = None,
+    ) -> pd.DataFrame:
+        "Cached equivalent of `grouped_obs_percent`."
+        return self.stats(adata, group_key, layer, genes).to_frame("percent")
+
+
+grouped_stats_cache = GroupedStatsCache()
+
 # %% ../nbs/00_util.ipynb #9de15f3d
 def rescale(
         x: pd.DataFrame,
@@ -150,15 +1165,87 @@ def rescale(
     return rescaled.T
 
 # %% ../nbs/00_util.ipynb #f1b4e6c7
-def find_center(coords):
+def _binned_modes(coords, codes, no_groups, grid_size=50):
+    """
+    Find the mode of the kernel density estimate of every group of points at once. The points of
+    each group are binned on a square grid of `grid_size` points per axis spanning the group, and the
+    histograms are smoothed with a separable Gaussian kernel whose width follows Scott's rule, as in
+    `scipy.stats.gaussian_kde`.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        A 2D array with X, Y-coordinates of every point.
+    codes : np.ndarray
+        The group code of every point; points with a negative code are ignored.
+    no_groups : int
+        The number of groups.
+    grid_size : int, optional
+        The number of grid points along each axis (default: 50).
+
+    Returns
+    -------
+    np.ndarray
+        A (no_groups, 2) array with the X, Y-coordinates of the mode of each group. Groups
+        without points get NaN.
+    """
+    keep = codes >= 0
+    coords = np.asarray(coords, dtype=np.float64)[keep]
+    codes = np.asarray(codes, dtype=np.int64)[keep]
+    sizes = np.bincount(codes, minlength=no_groups)
+
+    lows = np.full((no_groups, 2), np.inf)
+    highs = np.full((no_groups, 2), -np.inf)
+    np.minimum.at(lows, codes, coords)
+    np.maximum.at(highs, codes, coords)
+    steps = (highs - lows) / (grid_size - 1)
+    steps[~(steps > 0)] = 1.0  # single points, or all points on a line
+
+    # bandwidth from the per-group standard deviation (Scott's rule), in grid units
+    means = np.zeros((no_groups, 2))
+    np.add.at(means, codes, coords)
+    means /= np.maximum(sizes, 1)[:, None]
+    squares = np.zeros((no_groups, 2))
+    np.add.at(squares, codes, (coords - means[codes]) ** 2)
+    stds = np.sqrt(squares / np.maximum(sizes - 1, 1)[:, None])
+    sigmas = stds * np.maximum(sizes, 1)[:, None] ** (-1 / 6) / steps
+    sigmas = np.maximum(sigmas, 1e-12)
+
+    # histogram of every group on its own grid, in a single bincount
+    bins = np.rint((coords - lows[codes]) / steps[codes]).astype(np.int64)
+    bins = np.clip(bins, 0, grid_size - 1)
+    flat = (codes * grid_size + bins[:, 0]) * grid_size + bins[:, 1]
+    hist = np.bincount(flat, minlength=no_groups * grid_size * grid_size).reshape(
+        no_groups, grid_size, grid_size
+    )
+
+    # separable Gaussian smoothing: K_x @ H @ K_y^T for every group
+    offsets = np.arange(grid_size)
+    offsets = (offsets[:, None] - offsets[None, :]) ** 2
+    kernel_x = np.exp(-offsets[None] / (2 * sigmas[:, 0, None, None] ** 2))
+    kernel_y = np.exp(-offsets[None] / (2 * sigmas[:, 1, None, None] ** 2))
+    density = kernel_x @ hist.astype(np.float64) @ kernel_y.transpose(0, 2, 1)
+
+    peaks = np.argmax(density.reshape(no_groups, -1), axis=1)
+    modes = (
+        lows + np.stack(np.unravel_index(peaks, (grid_size, grid_size)), axis=1) * steps
+    )
+    modes[sizes == 0] = np.nan
+    return modes
+
+
+def find_center(coords, grid_size=50):
     """
     A function that estimates a Gaussian probability density for the input data and returns the
-    mode. From https://stackoverflow.com/a/60185876.
+    mode. Inspired by https://stackoverflow.com/a/60185876, but uses a binned kernel density
+    estimate that scales linearly with the number of points.
 
     Parameters
     ----------
     coords : np.ndarray
         A 2D array with X, Y-coordinates from xs, ys.
+    grid_size : int, optional
+        The number of grid points along each axis (default: 50).
 
     Returns
     -------
@@ -167,21 +1254,114 @@ def find_center(coords):
     float
         The Y-coordinate of the mode.
     """
-    kernel = gaussian_kde(coords.T)
-    min_x, min_y = np.min(coords, axis=0)
-    max_x, max_y = np.max(coords, axis=0)
-    grid_xs, grid_ys = np.mgrid[min_x:max_x:50j, min_y:max_y:50j]
-    positions = np.vstack(
-        [grid_xs.ravel(), grid_ys.ravel()]
-    )  # 2-dim array with X, Y-coordinates from xs, ys
-    Z = np.reshape(kernel(positions).T, grid_xs.shape)  # get densities
+    codes = np.zeros(len(coords), dtype=np.int64)
+    cx, cy = _binned_modes(coords, codes, 1, grid_size=grid_size)[0]
+    return cx, cy
+
+
+def find_centers(
+    adata, clustering, embedding="X_umap", grid_size=50, key_added=None, recompute=False
+):
+    """
+    Find the center of every cluster of a clustering on a low-dimensional embedding at once, as
+    `find_center` would. The centers are stored in `adata.uns` together with a fingerprint of the
+    embedding and the clustering, and reused by later calls as long as neither changes.
+
+    Parameters
+    ----------
+    adata : anndata.AnnData
+        AnnData object with the clustering and the embedding.
+    clustering : str
+        Clustering to use. Must be present in `adata.obs`.
+    embedding : str, optional
+        Embedding to use. Must be present in `adata.obsm` (default: "X_umap").
+    grid_size : int, optional
+        The number of grid points along each axis (default: 50).
+    key_added : str, optional
+        Key of `adata.uns` to store the centers under. If None, use
+        `f"{clustering}_{embedding}_centers"` (default: None).
+    recompute : bool, optional
+        If True, ignore centers already stored in `adata.uns` (default: False).
+
+    Returns
+    -------
+    pd.DataFrame
+        A dataframe with the X, Y-coordinates of the center of each cluster, indexed by cluster.
+    """
+    if key_added is None:
+        key_added = f"{clustering}_{embedding}_centers"
+    codes, clusters = _group_codes(adata, clustering)
+    coords = np.asarray(adata.obsm[embedding])[:, :2]
+    fingerprint = _fingerprint(coords, codes, clusters)
+    stored = adata.uns.get(key_added)
+    if (
+        not recompute
+        and stored is not None
+        and stored.get("fingerprint") == fingerprint
+        and stored["grid_size"] == grid_size
+    ):
+        centers = np.asarray(stored["centers"])
+    else:
+        centers = _binned_modes(coords, codes, len(clusters), grid_size=grid_size)
+        adata.uns[key_added] = {
+            "clusters": np.asarray(clusters.astype(str)),
+            "centers": centers,
+            "grid_size": grid_size,
+            "fingerprint": fingerprint,
+        }
+    return pd.DataFrame(centers.copy(), index=clusters, columns=["x", "y"])
 
-    idx = np.unravel_index(np.argmax(Z), Z.shape)
-    return grid_xs[idx], grid_ys[idx]
+# %% ../nbs/00_util.ipynb #6e1d2f58
+def resolve_palette(adata, key):
+    """
+    Find the colors of the categories of an `.obs` column without plotting it. Valid colors
+    already stored in `adata.uns[key + "_colors"]` are reused; otherwise the same default palette
+    that scanpy would assign is stored there.
+
+    Parameters
+    ----------
+    adata : anndata.AnnData
+        AnnData object with the annotation.
+    key : str
+        Categorical `.obs` column to find the colors of.
+
+    Returns
+    -------
+    list
+        The color of every category, in the order of the categories.
+    """
+    _codes, categories = _group_codes(adata, key)
+    length = len(categories)
+    colors = adata.uns.get(key + "_colors")
+    if (
+        colors is not None
+        and len(colors) >= length
+        and all(is_color_like(color) for color in colors)
+    ):
+        return list(colors[:length])
+
+    cycle = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    if len(cycle) >= length:
+        palette = cycle
+    else:
+        # scanpy is slow to import; only load it when its palettes are needed
+        from scanpy.plotting import palettes
+
+        if length <= 20:
+            palette = palettes.default_20
+        elif length <= 28:
+            palette = palettes.default_28
+        elif length <= len(palettes.default_102):
+            palette = palettes.default_102
+        else:
+            palette = ["grey"] * length
+    palette = [to_hex(color) for color in palette[:length]]
+    adata.uns[key + "_colors"] = palette
+    return palette
 
 # %% ../nbs/00_util.ipynb #8e390e9d
 def map_fine_to_coarse(
-    sm, species, fine, coarse=None, plot=sc.pl.umap, include_coarse=False
+    sm, species, fine, coarse=None, plot=None, include_coarse=False
 ):
     """
     Extract the mapping of fine to coarse clusters from a SAMap object.
@@ -198,7 +1378,8 @@ def map_fine_to_coarse(
         Coarse clustering slot name. If None, use the same as `fine`, mapping each cluster to
         itself. (default: `None`).
     plot : function, optional
-        Plotting function to use; this will correctly set the colors (default: `sc.pl.umap`).
+        Plotting function to render to set the colors, e.g. `sc.pl.umap`. If None, the colors are
+        resolved with `resolve_palette` without plotting (default: `None`).
     include_coarse : bool, optional
         If True, preface the fine cluster names with the coarse cluster names (default: `False`).
 
@@ -221,17 +1402,17 @@ def map_fine_to_coarse(
         .reset_index(drop=True)
     )
 
-    plt.ioff()
-    _fig = plot(sm.sams[species].adata, color=coarse, return_fig=True)
-    plt.close(_fig)
-    plt.ion()
+    adata = sm.sams[species].adata
+    if plot is None:
+        colors = resolve_palette(adata, coarse)
+    else:
+        plt.ioff()
+        _fig = plot(adata, color=coarse, return_fig=True)
+        plt.close(_fig)
+        plt.ion()
+        colors = adata.uns[coarse + "_colors"]
 
-    lut = dict(
-        zip(
-            sm.sams[species].adata.obs[coarse].cat.categories,
-            sm.sams[species].adata.uns[coarse + "_colors"],
-        )
-    )
+    lut = dict(zip(_group_codes(adata, coarse)[1], colors))
     handles = [Patch(facecolor=lut[name]) for name in lut]
     if include_coarse:
         fine_to_coarse[fine] = (
@@ -246,6 +1427,73 @@ def map_fine_to_coarse(
     return fine_to_coarse, lut, handles
 
 # %% ../nbs/00_util.ipynb #10070b78
+def _collapsed_columns(
+    adata: ad.AnnData, clusters: Iterable[str], fine: str, coarse: str
+) -> Tuple[pd.Series, dict]:
+    """
+    Collapse unrelated clusters for many fine clusters at once. The major coarse category of every
+    fine cluster is read off a single fine$\\times$coarse crosstab of the categorical codes, and one
+    collapsed annotation is built per distinct major category.
+
+    Parameters
+    ----------
+    adata : ad.AnnData
+        The annotation data containing the clusters to be collapsed.
+    clusters : Iterable[str]
+        The cluster identifiers within the `fine` column that need to be collapsed.
+    fine : str
+        The column name representing the fine-grained clustering.
+    coarse : str
+        The column name representing the coarse-grained clustering.
+
+    Returns
+    -------
+    pd.Series
+        The major coarse category of every cluster in `clusters`.
+    dict
+        The collapsed annotation (a `pd.Categorical`) of every major coarse category.
+    """
+    fine_codes, fine_categories = _group_codes(adata, fine)
+    coarse_codes, coarse_categories = _group_codes(adata, coarse)
+    fine_codes, coarse_codes = fine_codes.astype(np.int64), coarse_codes.astype(
+        np.int64
+    )
+    no_coarse = len(coarse_categories)
+
+    clusters = pd.Index(clusters)
+    cluster_codes = fine_categories.get_indexer(clusters)
+    if np.any(cluster_codes < 0):
+        raise KeyError(f"{list(clusters[cluster_codes < 0])} not in {fine}")
+
+    both = (fine_codes >= 0) & (coarse_codes >= 0)
+    crosstab = np.bincount(
+        fine_codes[both] * no_coarse + coarse_codes[both],
+        minlength=len(fine_categories) * no_coarse,
+    ).reshape(len(fine_categories), no_coarse)
+    majors = crosstab[cluster_codes].argmax(axis=1)
+
+    # coarse labels come first, then fine labels; missing values stay missing
+    labels = np.concatenate(
+        [coarse_categories.astype(str), fine_categories.astype(str), [""]]
+    )
+    collapsed = {}
+    for major in np.unique(majors):
+        cell_labels = np.where(
+            coarse_codes == major, no_coarse + fine_codes, coarse_codes
+        )
+        cell_labels[
+            (coarse_codes < 0) | ((coarse_codes == major) & (fine_codes < 0))
+        ] = -1
+        present = np.unique(cell_labels[cell_labels >= 0])
+        categories, positions = np.unique(labels[present], return_inverse=True)
+        lookup = np.full(len(labels), -1)
+        lookup[present] = positions
+        collapsed[coarse_categories[major]] = pd.Categorical.from_codes(
+            lookup[cell_labels], categories
+        )
+    return pd.Series(coarse_categories[majors], index=clusters), collapsed
+
+
 def collapse_unrelated_clusters(
     adata: ad.AnnData, cluster: str, fine: str, coarse: str
 ) -> None:
@@ -275,12 +1523,197 @@ def collapse_unrelated_clusters(
     Adds a new column to `adata.obs` named `fine + "_collapsed"` that contains the collapsed cluster
     information.
     """
-    cluster_members = adata.obs[fine] == cluster
-    major_cluster_category = adata.obs[coarse][cluster_members].value_counts().index[0]
+    majors, collapsed = _collapsed_columns(adata, [cluster], fine, coarse)
+    adata.obs[fine + "_collapsed"] = collapsed[majors.iloc[0]]
+
+
+def batch_collapse_unrelated_clusters(
+    adata: ad.AnnData,
+    fine: str,
+    coarse: str,
+    clusters: Union[Iterable[str], None] = None,
+) -> pd.Series:
+    """
+    Collapse unrelated clusters as `collapse_unrelated_clusters` does, for many fine clusters at
+    once. Fine clusters with the same major coarse category share the same collapsed annotation,
+    which is stored in a column named `fine + "_collapsed_" + major`.
+
+    Parameters
+    ----------
+    adata : ad.AnnData
+        The annotation data containing the clusters to be collapsed.
+    fine : str
+        The column name representing the fine-grained clustering.
+    coarse : str
+        The column name representing the coarse-grained clustering.
+    clusters : Iterable[str], optional
+        The cluster identifiers within the `fine` column that need to be collapsed. If None,
+        collapse all fine clusters (default: None).
+
+    Returns
+    -------
+    pd.Series
+        The name of the `adata.obs` column holding the collapsed annotation of every cluster.
+
+    Modifies
+    -------
+    Adds a column to `adata.obs` for every major coarse category of the clusters.
+    """
+    if clusters is None:
+        clusters = _group_codes(adata, fine)[1]
+    majors, collapsed = _collapsed_columns(adata, clusters, fine, coarse)
+    columns = pd.DataFrame(
+        {f"{fine}_collapsed_{major}": values for major, values in collapsed.items()},
+        index=adata.obs_names,
+    )
+    adata.obs = pd.concat(
+        [adata.obs.drop(columns=columns.columns, errors="ignore"), columns], axis=1
+    )
+    return fine + "_collapsed_" + majors.astype(str)
+
+# %% ../nbs/00_util.ipynb #1b0a264c
+_active_profiler = contextvars.ContextVar("comandos_profiler", default=None)
+
+
+class Profiler:
+    """
+    Record the wall time, memory peak and input sizes of the stages of a computation. Use it as a
+    context manager; stages inside it are recorded by `profile_stage`.
+
+    Parameters
+    ----------
+    callback : Union[Callable[[dict], None], None], optional
+        Function called with every record as soon as its stage ends (default: None).
+    memory : bool, optional
+        Whether to trace allocations with `tracemalloc` to find the memory peak of every stage.
+        Tracing makes allocations a little slower. The peaks need Python 3.9 or later; before, they
+        are NaN (default: True).
+    **context : Any
+        Fields added to every record, e.g. the cluster pair of a batch run.
+    """
+
+    def __init__(
+        self,
+        callback: Union[Callable[[dict], None], None] = None,
+        memory: bool = True,
+        **context: Any,
+    ):
+        self.callback = callback
+        self.memory = memory
+        self.context = context
+        self.records = []
+        self._peaks = []
+        # one entry per `with`, so that the same profiler can be re-entered, e.g. by `profiling`
+        self._entries = []
+
+    def __enter__(self) -> "Profiler":
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        self._entries.append((_active_profiler.set(self), started_tracing))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        token, started_tracing = self._entries.pop()
+        _active_profiler.reset(token)
+        if started_tracing:
+            tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str, **sizes: Any):
+        """
+        Record a stage of the computation.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        **sizes : Any
+            Input sizes to add to the record, e.g. the number of cells or genes.
+        """
+        # the peak of a stage cannot be isolated without `reset_peak`, which is new in Python 3.9
+        tracing = (
+            self.memory
+            and tracemalloc.is_tracing()
+            and hasattr(tracemalloc, "reset_peak")
+        )
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # resetting the peak below hides it from the enclosing stage, so hand it over first
+            if self._peaks:
+                self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append([current, current])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_mb = np.nan
+            if tracing:
+                baseline, seen = self._peaks.pop()
+                peak = max(tracemalloc.get_traced_memory()[1], seen)
+                peak_mb = (peak - baseline) / 2**20
+                if self._peaks:
+                    self._peaks[-1][1] = max(self._peaks[-1][1], peak)
+            record = {
+                **self.context,
+                "stage": name,
+                "seconds": seconds,
+                "peak_mb": peak_mb,
+                **sizes,
+            }
+            self.add(record)
+
+    def add(self, record: dict) -> None:
+        "Keep a record, e.g. one collected in a worker process, and pass it to the callback."
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def child(self, **context: Any) -> "Profiler":
+        """
+        A profiler whose records carry additional context fields and are also added to this one.
+
+        Parameters
+        ----------
+        **context : Any
+            Fields added to every record of the child, e.g. the cluster pair of a batch run.
+        """
+        return Profiler(
+            callback=self.add, memory=self.memory, **{**self.context, **context}
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        "The records of all stages so far, one row per stage."
+        return pd.DataFrame(self.records)
+
+
+def profile_stage(
+    name: str,  # name of the stage
+    **sizes: Any,  # input sizes to add to the record, e.g. the number of cells or genes
+):  # a context manager around the stage
+    "Record a stage with the active `Profiler`; without one, do nothing."
+    profiler = _active_profiler.get()
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name, **sizes)
 
-    major_category_members = np.array(adata.obs[coarse] == major_cluster_category)
 
-    summary = adata.obs[coarse].astype(str).values
-    summary[major_category_members] = adata.obs[fine][major_category_members].values
-    adata.obs[fine + "_collapsed"] = summary
-    adata.obs[fine + "_collapsed"] = adata.obs[fine + "_collapsed"].astype("category")
+def profiling(
+    profile: Union[
+        bool, Callable[[dict], None], Profiler, None
+    ],  # the `profile` argument of a plotting function
+    **context: Any,  # fields added to every record
+) -> Union[
+    Profiler, nullcontext
+]:  # a context manager that yields the profiler, or None
+    "Translate the `profile` argument of a plotting function into a profiler to activate."
+    if isinstance(profile, Profiler):
+        return profile
+    if callable(profile):
+        return Profiler(callback=profile, **context)
+    if profile:
+        return Profiler(**context)
+    # an already active profiler keeps recording, e.g. for the stages of `paired_dotplot`
+    return nullcontext(_active_profiler.get())